@@ -1,8 +1,13 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 import altair as alt
+import hashlib, io, json, os, shutil, sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 
 # --- CONFIGURATION PAGE WEB ---
 st.set_page_config(page_title="36.9° Analytique", layout="wide", page_icon="📊")
@@ -53,12 +58,22 @@ def nettoyer_code_tarif(val):
             return f"{entier}.{dec.ljust(3, '0')}"
     return s
 
+def nettoyer_codes(serie):
+    """Version colonne de nettoyer_code_tarif : chaque code distinct n'est nettoyé qu'une fois,
+    le résultat est une colonne catégorielle (quelques centaines de codes pour des millions de lignes)."""
+    positions, distincts = pd.factorize(serie, use_na_sentinel=False)
+    propres = pd.Index([nettoyer_code_tarif(v) for v in distincts])
+    categories = pd.Index(sorted(set(propres)))
+    table = categories.get_indexer(propres)
+    return pd.Series(pd.Categorical.from_codes(table[positions], categories), index=serie.index, name=serie.name)
+
 def resoudre_colonnes(df):
     """Détecte les colonnes d'un export Factures Ephysio par leur nom.
     Compatible export mono-thérapeute (20 col) et multi-thérapeutes (23 col).
+    Accepte un DataFrame ou directement la liste des en-têtes.
     Retourne un dict {nom_logique: nom_colonne_réel}."""
-    cols = {str(c).strip(): c for c in df.columns}
-    cols_lower = {str(c).strip().lower(): c for c in df.columns}
+    colonnes = df.columns if hasattr(df, "columns") else df
+    cols_lower = {str(c).strip().lower(): c for c in colonnes}
 
     def trouver(candidats):
         for c in candidats:
@@ -68,6 +83,7 @@ def resoudre_colonnes(df):
 
     return {
         # Export Factures
+        "num_facture":    trouver(["numéro de facture", "numero de facture", "n° de facture"]),
         "date_facture":   trouver(["date"]),
         "loi":            trouver(["loi"]),
         "tp_tg":          trouver(["tp/tg"]),
@@ -236,14 +252,85 @@ def generer_pdf_plotly(titre, fig, sous_titre=""):
     return buf
 
 
-def jours_ouvres(date_debut, date_fin, jours_cabinet=None):
-    """Nombre de jours où le cabinet était réellement ouvert entre deux dates.
-    Si jours_cabinet (set de date) est fourni, on compte les jours avec prestations.
+def semaines_iso(dates):
+    """Clé entière de semaine ISO (année ISO * 100 + n° de semaine, ex. 202601) d'une colonne de dates :
+    comparable et comptable (nunique) sans passer par du texte."""
+    iso = dates.dt.isocalendar()
+    return (iso["year"] * 100 + iso["week"]).astype("int32")
+
+def calendrier_ouverture(dates, montants, seuil_jour):
+    """Calendrier des jours où le cabinet était réellement ouvert (CA du jour >= seuil_jour), construit
+    une fois par jeu de données et seuil : tableau booléen journalier depuis le premier jour ouvert
+    et ses sommes cumulées, pour que jours_ouvres() réponde en temps constant sur toute plage."""
+    ca_jour = montants.groupby(dates.dt.normalize()).sum()
+    jours = ca_jour.index[ca_jour >= seuil_jour]
+    if jours.empty:
+        return {"origine": pd.Timestamp(datetime.today().date()), "ouvert": np.zeros(0, dtype=bool), "cumul": np.zeros(1, dtype=np.int64)}
+    origine = jours.min()
+    ouvert = np.zeros((jours.max() - origine).days + 1, dtype=bool)
+    ouvert[(jours - origine).days] = True
+    return {"origine": origine, "ouvert": ouvert, "cumul": np.concatenate([[0], np.cumsum(ouvert)])}
+
+def ouvertures(calendrier, jours):
+    """Indicateur jour ouvert (tableau booléen) pour chaque jour d'un DatetimeIndex journalier."""
+    pos = (jours.normalize() - calendrier["origine"]).days.to_numpy()
+    dedans = (pos >= 0) & (pos < len(calendrier["ouvert"]))
+    ouvert = np.zeros(len(jours), dtype=bool)
+    ouvert[dedans] = calendrier["ouvert"][pos[dedans]]
+    return ouvert
+
+def jours_ouvres(date_debut, date_fin, calendrier=None):
+    """Nombre de jours où le cabinet était réellement ouvert entre deux dates (bornes incluses).
+    Si un calendrier (calendrier_ouverture) est fourni, lecture directe de ses cumuls.
     Sinon, repli sur lun-ven (bdate_range) pour les modules sans ce contexte."""
-    if jours_cabinet is not None:
-        return max(sum(1 for d in pd.date_range(date_debut, date_fin) if d.date() in jours_cabinet), 1)
+    if calendrier is not None:
+        # Mêmes jours que pd.date_range(date_debut, date_fin) : pas d'un jour depuis date_debut
+        nb_jours = (pd.Timestamp(date_fin) - pd.Timestamp(date_debut)) // pd.Timedelta(days=1) + 1
+        if nb_jours <= 0:
+            return 1
+        debut = (pd.Timestamp(date_debut).normalize() - calendrier["origine"]).days
+        taille = len(calendrier["ouvert"])
+        i0, i1 = min(max(debut, 0), taille), min(max(debut + nb_jours, 0), taille)
+        return max(int(calendrier["cumul"][i1] - calendrier["cumul"][i0]), 1)
     return max(len(pd.bdate_range(date_debut, date_fin)), 1)
 
+def courbe_recrutement(recrutement, fenetre):
+    """Taux de recrutement glissant (nouveaux patients / jour ouvré) sur les <fenetre> jours précédant
+    chaque date, lu sur les cumuls de l'index journalier (mêmes bornes que les métriques du flux)."""
+    nouveaux = recrutement["cumul_nouveaux"] - recrutement["cumul_nouveaux"].shift(fenetre + 1, fill_value=0)
+    ouverts = recrutement["cumul_ouverts"] - recrutement["cumul_ouverts"].shift(fenetre + 1, fill_value=0)
+    # Les <fenetre> premiers jours n'ont pas d'historique complet : pas de point
+    return (nouveaux / ouverts.clip(lower=1)).iloc[fenetre:].rename(f"Nouveaux / j ouvré ({fenetre}j glissants)")
+
+# Axes de la grille de scénarios du simulateur (ordre des dimensions du tableau calculé)
+AXES_SCENARIOS = {
+    "occupation": "Taux d'occupation (%)",
+    "rythme": "Rythme hebdomadaire",
+    "seances": "Séances / traitement",
+    "jours": "Jours d'ouverture / semaine",
+}
+
+def grille_scenarios(capa_df, chron, axes):
+    """Besoin en nouveaux patients / jour pour toute une grille de scénarios, en un seul calcul NumPy.
+    axes : {nom: valeurs} pour chaque clé de AXES_SCENARIOS. Même formule que le scénario unique :
+    capacité = places annuelles × occupation / 52.14, moins les RDV chroniques (répartis entre cabinets
+    au prorata de leur capacité), × rythme / séances par traitement / jours d'ouverture.
+    Retourne {"TOTAL"|"A"|"B": tableau de dimensions (occupation, rythme, séances, jours)}."""
+    occ, ryt, sea, jou = np.ix_(*[np.asarray(axes[k], dtype=float) for k in AXES_SCENARIOS])
+    df_act = capa_df[capa_df["Places/Sem"] > 0]
+    annuel = (df_act["Places/Sem"] * df_act["Semaines/an"]).groupby(df_act["Cabinet"]).sum()
+    annuel_tot = annuel.sum()
+    grille = {}
+    for cab in ["TOTAL", "A", "B"]:
+        if cab == "TOTAL":
+            annuel_cab, prop = annuel_tot, 1.0
+        else:
+            annuel_cab = annuel.get(cab, 0)
+            prop = annuel_cab / annuel_tot if annuel_tot > 0 else 0.5
+        dispo = np.maximum(0, annuel_cab * occ / 100 / 52.14 - chron * prop)
+        grille[cab] = dispo * ryt / sea / jou
+    return grille
+
 def calculer_tendance(ca_60j, ca_365j, jo_60, jo_365):
     """Compare le taux journalier (CHF/jour ouvré) des 60 derniers jours
     vs les 365 derniers jours. Neutre aux vacances, Noël, ponts, etc.
@@ -262,11 +349,6 @@ def calculer_tendance(ca_60j, ca_365j, jo_60, jo_365):
         return f"➡️ Stable ({variation:+.1f}%/j)"
     return "—"
 
-def valider_colonnes(df, nb_min, nom_module):
-    """Valide que le DataFrame a assez de colonnes, lève une erreur claire sinon."""
-    if len(df.columns) < nb_min:
-        raise ValueError(f"[{nom_module}] Le fichier semble incorrect : {len(df.columns)} colonnes trouvées, {nb_min} attendues minimum.")
-
 def assigner_profession(code):
     """Logique métier spécifique au module Tarifs"""
     c = str(code).strip().lower()
@@ -280,32 +362,1216 @@ def assigner_profession(code):
         return "Massage"
     return "Autre"
 
-def convertir_date(val):
-    """Conversion robuste des dates pour tous les modules"""
-    if pd.isna(val) or str(val).strip() == "": return pd.NaT
-    if isinstance(val, pd.Timestamp): return val
+def remapper_categories(serie, fonction):
+    """Applique `fonction` à chaque catégorie d'une colonne catégorielle (et non à chaque ligne).
+    Les catégories qui deviennent identiques sont fusionnées, les valeurs manquantes restent manquantes.
+    Remplace .replace / .apply / .astype(str).str… qui feraient repasser la colonne en texte."""
+    resultats = pd.Index([fonction(c) for c in serie.cat.categories])
+    categories = pd.Index(sorted(set(resultats)))
+    table = categories.get_indexer(resultats)
+    positions = serie.cat.codes.to_numpy()
+    return pd.Series(pd.Categorical.from_codes(np.where(positions >= 0, table[positions], -1), categories),
+                     index=serie.index, name=serie.name)
+
+def completer_categories(serie, valeurs):
+    """Ajoute à une colonne catégorielle les valeurs qui manquent à ses catégories (avant fillna ou affectation).
+    Les catégories restent triées, comme à l'ingestion."""
+    nouvelles = [v for v in valeurs if v not in serie.cat.categories]
+    return serie.cat.set_categories(sorted([*serie.cat.categories, *nouvelles])) if nouvelles else serie
+
+def professions_par_code(codes):
+    """Profession de chaque ligne d'une colonne catégorielle de codes : assigner_profession
+    n'est appelée qu'une fois par code, puis reportée sur les lignes."""
+    return remapper_categories(codes, assigner_profession)
+
+TYPES_DATE = (datetime, date, pd.Timestamp, np.datetime64)
+
+def convertir_dates(serie):
+    """Conversion vectorisée d'une colonne de dates, avec les règles de l'ancienne conversion cellule par cellule :
+    les textes 'jj.mm.aaaa' (espaces ignorés) sont lus en un seul appel ; vides, nombres et tout autre texte
+    donnent NaT (pas d'analyse générique : '2024-13-01' ou '2024-01-13' restent NaT).
+
+    Un seul écart, voulu : les valeurs déjà datées (Timestamp, datetime, date, datetime64) passent telles
+    quelles. L'ancienne version ne gardait que les Timestamp et rendait NaT pour les autres, leur texte
+    n'étant pas au format jj.mm.aaaa ; or openpyxl lit les cellules de dates Excel en datetime.
+    Comportement figé par tests/test_dates.py.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    valeurs = pd.Series(serie.to_numpy(dtype=object))
+    types = valeurs.map(type)
+    res = pd.Series(pd.NaT, index=valeurs.index, dtype="datetime64[ns]")
+
+    deja = types.isin(TYPES_DATE) & valeurs.notna()
+    if deja.any():
+        res[deja] = pd.to_datetime(valeurs[deja], errors="coerce")
+
+    textes = valeurs[types == str]
+    if not textes.empty:
+        textes = textes.str.strip()
+        textes = textes[textes != ""]
+    if not textes.empty:
+        res[textes.index] = pd.to_datetime(textes, format="%d.%m.%Y", errors="coerce")
+    return pd.Series(res.to_numpy(), index=serie.index, name=serie.name)
+
+# --- GROUPES D'ASSUREURS SUISSES ---
+# Table par défaut (nom exact dans Ephysio → nom du groupe affiché), remplaçable par groupes_assureurs.xlsx
+GROUPES_ASSUREURS_DEFAUT = {
+    # LAMal — Groupe Mutuel
+    "Philos, caisse maladie":            "Groupe Mutuel, caisse maladie",
+    "Caisse maladie Avenir":              "Groupe Mutuel, caisse maladie",
+    "Easy Sana caisse maladie":           "Groupe Mutuel, caisse maladie",
+    "SUPRA-1846 SA":                      "Groupe Mutuel, caisse maladie",
+    # LAMal — CSS
+    "Arcosana":                           "CSS Assurances",
+    "Intras, caisse maladie":              "CSS Assurances",
+    # LAMal — Helsana
+    "Progrès (incl. Sansan)":              "Helsana Assurances",
+    # LAMal — Visana
+    "sana24":                              "Visana Services AG",
+    "vivacare":                            "Visana Services AG",
+    "GALENOS":                             "Visana Services AG",
+    # LAA — Groupe Mutuel
+    "Caisse maladie Avenir (accident)":    "Groupe Mutuel, caisse maladie (accident)",
+}
+# LCA et LAI exclues du regroupement
+LOIS_EXCLUES_REGROUPEMENT = {"LCA", "LAI"}
+
+def appliquer_groupes_assureurs(assureurs, lois, groupes):
+    """Remplace chaque assureur par son groupe (table `groupes`, noms comparés sans espaces autour), sauf pour
+    les lois exclues du regroupement. La table est appliquée aux catégories de la colonne, pas à chaque ligne ;
+    le masque par loi choisit ensuite, ligne à ligne, le code d'origine ou le code regroupé."""
+    regroupes = remapper_categories(assureurs, lambda a: groupes.get(str(a).strip(), str(a).strip()))
+    categories = sorted(set(assureurs.cat.categories) | set(regroupes.cat.categories))
+    codes = np.where(lois.isin(LOIS_EXCLUES_REGROUPEMENT).to_numpy(),
+                     assureurs.cat.set_categories(categories).cat.codes, regroupes.cat.set_categories(categories).cat.codes)
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=assureurs.index, name=assureurs.name)
+
+def tranches_periode(donnees, mois):
+    """Factures (toutes, puis payées) émises depuis `mois` mois avant ajd (None = tout l'historique) :
+    tranches sans copie des tableaux triés par date_facture, bornes trouvées par recherche dichotomique."""
+    if mois is None:
+        return donnees["df"], donnees["payees"]
+    limite = donnees["ajd"] - pd.DateOffset(months=mois)
+    return tuple(d.iloc[d["date_facture"].searchsorted(limite):] for d in (donnees["df"], donnees["payees"]))
+
+def agregat_periode(donnees, mois, nom, calcul):
+    """Agrégat `nom` d'une période : calcul(factures, factures payées) à la première demande, puis gardé
+    avec les données du jeu de filtres courant (recalculé seulement quand les filtres changent)."""
+    agregats = donnees["agregats"]
+    if (mois, nom) not in agregats:
+        agregats[(mois, nom)] = calcul(*tranches_periode(donnees, mois))
+    return agregats[(mois, nom)]
+
+# Mesures de la série mensuelle des délais de paiement : libellé → colonne de delais_mensuels
+MESURES_DELAIS = {"Moyenne": "moyenne", "Médiane": "mediane", "P90": "p90"}
+
+def delais_mensuels(payees):
+    """Série mensuelle des délais de paiement par assureur : un seul regroupement (assureur, mois de
+    facturation) pour la moyenne, la médiane, le 90e centile et le nombre de factures payées.
+    Index (assureur, mois), le mois étant le premier jour du mois."""
+    mois = payees["date_facture"].dt.to_period("M").dt.to_timestamp().rename("mois")
+    groupes = payees.groupby([payees["assureur"], mois], observed=True)["delai"]
+    return pd.DataFrame({"moyenne": groupes.mean(), "mediane": groupes.median(), "p90": groupes.quantile(0.9),
+                         "nb": groupes.size()})
+
+def courbes_delais(serie, colonne, assureurs, lissage):
+    """Mois × assureurs d'une mesure de delais_mensuels sur un axe mensuel continu (mois sans facture payée
+    = trou), puis moyenne glissante sur `lissage` mois des seuls mois renseignés de la fenêtre ; un mois
+    sans facture payée reste un trou après lissage. Valeurs arrondies à 2 décimales."""
+    courbes = serie.loc[serie.index.get_level_values("assureur").isin(assureurs), colonne] \
+                   .unstack(level="assureur").asfreq("MS")
+    courbes.columns = courbes.columns.astype(str)
+    return courbes.rolling(lissage, min_periods=1).mean().where(courbes.notna()).round(2)
+
+# Horizon (jours) de la courbe d'encaissement des factures en attente
+HORIZON_ENCAISSEMENT = 180
+
+def survie_paiements(df_p, ajd):
+    """Courbes de survie de Kaplan–Meier « facture encore impayée après t jours » d'une période, ajustées
+    une fois : les factures payées comptent pour leur délai de paiement, les factures encore en attente
+    sont censurées à leur âge actuel (elles restent à risque jusque-là au lieu d'être ignorées).
+    Une courbe par (assureur, fournisseur), par fournisseur et globale, empilées dans une seule matrice
+    (courbes × jours). Retourne None si la période n'a aucune facture exploitable."""
+    payee = df_p["date_paiement"].notna()
+    en_attente = df_p["statut"].str.startswith("en attente", na=False) & (df_p["statut"] != "en attente (annulé)")
+    obs = df_p[payee | en_attente]
+    duree = (obs["date_paiement"].fillna(ajd) - obs["date_facture"]).dt.days
+    obs, duree = obs[duree.notna()], duree.dropna()
+    if obs.empty:
+        return None
+    duree = duree.clip(lower=0).astype(int).to_numpy()
+    paye = obs["date_paiement"].notna().to_numpy()
+    nb_jours = int(duree.max()) + 1
+    niveaux, courbes, debut = {}, [], 0
+    for nom, cles in (("croisees", ["assureur", "fournisseur"]), ("fournisseurs", ["fournisseur"]), ("global", [])):
+        if cles:
+            groupes = obs[cles].astype(object).reset_index(drop=True)
+            table = groupes.dropna().drop_duplicates().reset_index(drop=True)
+            ligne = groupes.merge(table.assign(_ligne=np.arange(len(table))), on=cles, how="left")["_ligne"].to_numpy()
+            garde = ~np.isnan(ligne)
+            ligne = ligne[garde].astype(int)
+        else:
+            table, garde, ligne = None, np.ones(len(obs), dtype=bool), np.zeros(len(obs), dtype=int)
+        nb = len(table) if cles else 1
+        # Sorties (paiement ou censure) et paiements par courbe et par jour, puis estimateur produit
+        sorties, paiements = np.zeros((nb, nb_jours)), np.zeros((nb, nb_jours))
+        np.add.at(sorties, (ligne, duree[garde]), 1)
+        np.add.at(paiements, (ligne, duree[garde]), paye[garde])
+        a_risque = sorties.sum(axis=1, keepdims=True) - (np.cumsum(sorties, axis=1) - sorties)
+        risque = np.divide(paiements, a_risque, out=np.zeros_like(paiements), where=a_risque > 0)
+        courbes.append(np.cumprod(1 - risque, axis=1))
+        niveaux[nom] = (cles, table, debut)
+        debut += nb
+    return {"survie": np.vstack(courbes), "niveaux": niveaux, "nb_jours": nb_jours}
+
+def taux_paiement_global(modele, jours):
+    """Part des factures payées sous chaque délai (1 − survie globale), pour une liste de délais"""
+    if modele is None:
+        return np.zeros(len(jours))
+    _, _, ligne = modele["niveaux"]["global"]
+    colonnes = np.minimum(np.maximum(jours, 0), modele["nb_jours"] - 1)
+    return 1 - modele["survie"][ligne, colonnes]
+
+def probas_encaissement(f_attente, modele, jours):
+    """Pour chaque facture en attente d'âge a et chaque délai j de `jours` : P(payée d'ici a+j | impayée à a)
+    = 1 − S(a+j)/S(a), lue sur la courbe (assureur, fournisseur), à défaut du fournisseur, à défaut globale,
+    pourvu que S(a) > 0. Une facture plus âgée que tout l'historique payé n'a pas d'estimation (probabilités
+    nulles). Retourne (montants, probabilités factures × jours)."""
+    montants = f_attente["montant"].fillna(0).to_numpy(dtype=float)
+    probas = np.zeros((len(f_attente), len(jours)))
+    if modele is None or f_attente.empty:
+        return montants, probas
+    survie, dernier = modele["survie"], modele["nb_jours"] - 1
+    # Au-delà du dernier jour observé, la survie reste à sa dernière valeur
+    age = f_attente["delai_actuel"].fillna(0).clip(lower=0).astype(int).to_numpy()
+    col_age = np.minimum(age, dernier)
+    att = f_attente[["assureur", "fournisseur"]].astype(object).reset_index(drop=True)
+    ligne = np.full(len(att), -1)
+    # Du niveau le plus grossier au plus fin : chaque niveau disponible remplace le précédent
+    for nom in ("global", "fournisseurs", "croisees"):
+        cles, table, debut = modele["niveaux"][nom]
+        if cles:
+            cand = att[cles].merge(table.assign(_ligne=np.arange(len(table)) + debut), on=cles, how="left")["_ligne"]
+            cand = cand.fillna(-1).astype(int).to_numpy()
+        else:
+            cand = np.full(len(att), debut)
+        ligne = np.where((cand >= 0) & (survie[np.maximum(cand, 0), col_age] > 0), cand, ligne)
+    connue = ligne >= 0
+    s_age = survie[ligne[connue], col_age[connue]]
+    s_jours = survie[ligne[connue][:, None], np.minimum(age[connue][:, None] + np.asarray(jours), dernier)]
+    probas[connue] = 1 - s_jours / s_age[:, None]
+    return montants, probas
+
+def courbe_encaissements(f_attente, modele, horizon=HORIZON_ENCAISSEMENT):
+    """Encaissement cumulé attendu des factures en attente, pour chaque jour h de 0 à horizon : somme des
+    montants × probabilité d'être payée d'ici h jours (voir probas_encaissement).
+    Tout horizon ou toute date cible devient une simple lecture dans le tableau retourné."""
+    montants, probas = probas_encaissement(f_attente, modele, np.arange(horizon + 1))
+    return montants @ probas
+
+# Simulation de Monte Carlo des encaissements : nombre de scénarios, factures tirées par bloc
+NB_SCENARIOS = 10_000
+FACTURES_PAR_BLOC = 250
+
+def simuler_encaissements(f_attente, modele, jours, nb_scenarios=NB_SCENARIOS, graine=0):
+    """Montants cumulés encaissés d'ici chaque délai de `jours` (croissants), dans nb_scenarios scénarios.
+    Tirage inverse : pour chaque facture en attente, un uniforme u par scénario, placé par searchsorted
+    dans ses probabilités d'être payée d'ici chaque délai (probas_encaissement : distribution observée de
+    son assureur sachant son âge) ; on obtient le premier délai atteint (len(jours) : plus tard). Les montants
+    sont sommés par scénario et par délai (bincount), puis cumulés. Graine fixe : mêmes résultats d'un
+    affichage à l'autre. Retourne une matrice nb_scenarios × len(jours)."""
+    montants, probas = probas_encaissement(f_attente, modele, jours)
+    # Les factures sans chance d'être payées d'ici le dernier délai ne changent aucun scénario
+    garde = probas[:, -1] > 0
+    montants, probas = montants[garde], probas[garde]
+    nb_delais = len(jours)
+    rng = np.random.default_rng(graine)
+    # Tirages rangés dans une table aplatie scénarios × (délais + « plus tard »)
+    decalages = (nb_delais + 1) * np.arange(nb_scenarios)
+    par_delai = np.zeros(nb_scenarios * (nb_delais + 1))
+    for debut in range(0, len(montants), FACTURES_PAR_BLOC):
+        bloc = slice(debut, debut + FACTURES_PAR_BLOC)
+        u = rng.random((len(montants[bloc]), nb_scenarios))
+        cases = np.empty(u.shape, dtype=np.intp)
+        for j, p in enumerate(probas[bloc]):
+            # payée d'ici jours[k] si u < p[k] : premier délai atteint = nombre de p[k] ≤ u
+            cases[j] = np.searchsorted(p, u[j], side="right")
+        cases += decalages
+        par_delai += np.bincount(cases.ravel(), weights=np.repeat(montants[bloc], nb_scenarios), minlength=len(par_delai))
+    return np.cumsum(par_delai.reshape(nb_scenarios, nb_delais + 1)[:, :nb_delais], axis=1)
+
+# --- INGESTION DES EXPORTS (lecture unique partagée par tous les modules) ---
+# Positions historiques utilisées quand une colonne n'est pas trouvée par son nom
+COLONNES_REPLI = {
+    "prestations": {"num_facture": 0, "date_facture": 1, "code_tarifaire": 2, "description": 3, "num_patient": 8, "chiffre": 11},
+    "factures":    {"num_facture": 0, "date_facture": 2, "montant": 14, "date_paiement": 15},
+}
+# Schéma logique fixe de chaque rôle : tout onglet ingéré expose exactement ces colonnes, dans cet ordre
+COLONNES_ROLES = {
+    "prestations": ["num_facture", "date_facture", "code_tarifaire", "description", "quantite", "nb_points", "valeur_point",
+                    "therapeute", "num_patient", "patient", "facturation", "chiffre"],
+    "factures":    ["num_facture", "num_patient", "date_facture", "patient", "loi", "tp_tg", "medecin", "assureur", "statut",
+                    "fournisseur", "montant", "date_paiement", "montant_paye", "chiffre"],
+}
+# Variantes Ephysio connues, dans l'ordre d'essai : un onglet relève de la première variante de son rôle
+# dont les colonnes distinctives sont trouvées par leur nom. Colonnes obligatoires et nombre minimal
+# de colonnes sont vérifiés à l'ingestion ; defauts remplit les colonnes logiques absentes de la variante.
+SCHEMAS_EPHYSIO = [
+    {"nom": "Prestation", "role": "prestations", "distinctives": ["code_tarifaire"], "nb_min": 0,
+     "obligatoires": ["num_facture", "date_facture", "code_tarifaire", "chiffre"], "defauts": {}},
+    {"nom": "Factures multi-thérapeutes (23 col.)", "role": "factures", "distinctives": ["fournisseur"], "nb_min": 16,
+     "obligatoires": ["num_facture", "date_facture", "montant", "date_paiement"], "defauts": {}},
+    {"nom": "Factures mono-thérapeute (20 col.)", "role": "factures", "distinctives": [], "nb_min": 16,
+     "obligatoires": ["num_facture", "date_facture", "montant", "date_paiement"], "defauts": {"fournisseur": "Cabinet"}},
+]
+NOMS_ONGLETS = {"prestations": "Prestation", "factures": "Factures"}
+COLONNES_DATES    = ["date_facture", "date_paiement"]
+# Schéma compact appliqué à l'ingestion : dates en datetime64, montants CHF en float64 (sommes au centime
+# sur des centaines de milliers de lignes), quantités et points en float32, texte peu varié en catégories.
+# Numéros de patient, noms de patients et codes restent hors de cette liste ; le n° de facture est mis sous
+# forme canonique puis en catégorie à la finalisation de l'onglet (voir normaliser_numeros).
+COLONNES_MONTANTS   = ["montant", "chiffre", "montant_paye"]
+COLONNES_QUANTITES  = ["quantite", "nb_points", "valeur_point"]
+COLONNES_CATEGORIES = ["loi", "tp_tg", "assureur", "fournisseur", "statut", "medecin", "description", "therapeute", "facturation"]
+NB_EXPORTS_MAX = 4  # exports conservés simultanément dans le registre de session
+# Cache disque des exports déjà lus (Parquet, clé = SHA-256 du fichier) — survit aux redémarrages
+DOSSIER_CACHE = os.environ.get("STATS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "statistiques"))
+TAILLE_MAX_CACHE_MO = 500
+VERSION_CACHE = 6  # à incrémenter quand le typage des onglets change
+TAILLE_BLOC = 5000  # lignes lues et typées à la fois par le lecteur en flux
+# Base locale SQLite (optionnelle) : historique Prestation/Factures et tables de configuration, d'une session à l'autre.
+# Activée en donnant le chemin du fichier dans STATS_DB (ex. ~/statistiques.sqlite).
+CHEMIN_BASE = os.environ.get("STATS_DB")
+# Médecins et Tarifs comparent au plus les 365 derniers jours ou la même période N-1 : depuis la base locale,
+# ils ne lisent que les ANNEES_BASE_PERFORMANCE dernières années (à partir du premier jour du mois)
+ANNEES_BASE_PERFORMANCE = 2
+
+def trouver_onglet(onglets, exact, partiel):
+    """Nom d'onglet égal à `exact`, sinon contenant `partiel` (insensible à la casse)."""
+    return next((s for s in onglets if s.strip().lower() == exact), None) or \
+           next((s for s in onglets if partiel in s.lower()), None)
+
+@lru_cache(maxsize=None)
+def schema_onglet(entetes, role):
+    """Variante Ephysio et positions des colonnes utiles d'un onglet, d'après la signature de ses en-têtes
+    (tuple). Les colonnes sont trouvées par leur nom (resoudre_colonnes), à défaut aux positions de repli ;
+    les autres colonnes de l'export ne sont pas lues. Mémorisé : une signature n'est résolue qu'une fois.
+    Retourne (variante, {nom_logique: index}) ; ValueError si l'onglet ne correspond à aucune variante du rôle."""
+    cols = resoudre_colonnes(entetes)
+    for variante in SCHEMAS_EPHYSIO:
+        if variante["role"] != role or any(cols[c] is None for c in variante["distinctives"]):
+            continue
+        if len(entetes) < variante["nb_min"]:
+            raise ValueError(f"[{NOMS_ONGLETS[role]}] Le fichier semble incorrect : {len(entetes)} colonnes trouvées, "
+                             f"{variante['nb_min']} attendues minimum.")
+        for cle, pos in COLONNES_REPLI[role].items():
+            if cols[cle] is None and pos < len(entetes) and entetes[pos] not in cols.values():
+                cols[cle] = entetes[pos]
+        manquantes = [c for c in variante["obligatoires"] if cols[c] is None]
+        if manquantes:
+            raise ValueError(f"[{NOMS_ONGLETS[role]}] Colonnes introuvables : {', '.join(manquantes)}.")
+        return variante, {cle: entetes.index(cols[cle]) for cle in COLONNES_ROLES[role] if cols[cle] is not None}
+    raise ValueError(f"[{NOMS_ONGLETS[role]}] En-têtes non reconnus : aucune variante d'export Ephysio ne correspond.")
+
+def entetes_onglet(ws):
+    """En-têtes (première ligne) d'un onglet ouvert en lecture seule."""
+    return tuple("" if c is None else str(c).strip() for c in next(ws.iter_rows(max_row=1, values_only=True), ()))
+
+def onglet_export(ds, role):
+    """Onglet typé d'un export. ValueError explicite s'il manque : absent du classeur, ou refusé
+    à l'ingestion (le message dit pourquoi)."""
+    if ds[role] is None:
+        anomalie = (ds.get("anomalies") or {}).get(role)
+        raise ValueError(anomalie or f"Onglet '{NOMS_ONGLETS[role]}' introuvable dans {ds['nom']} "
+                                     f"(onglets : {', '.join(ds['onglets'])}).")
+    return ds[role]
+
+def typer_bloc(df):
+    """Convertit un bloc de lignes : dates, montants et quantités."""
+    for c in COLONNES_DATES:
+        if c in df.columns and not pd.api.types.is_datetime64_any_dtype(df[c]):
+            df[c] = convertir_dates(df[c])
+    for c in COLONNES_MONTANTS:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors="coerce").astype("float64")
+    for c in COLONNES_QUANTITES:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors="coerce").astype("float32")
+    return df
+
+def normaliser_numeros(serie):
+    """Numéros de facture sous une forme canonique, indépendante du type déduit à la lecture : texte sans
+    espaces autour, nombres entiers écrits sans décimale (123, 123.0, "123" et " 123 " → "123").
+    Calculé une fois par valeur distincte ; les valeurs manquantes ou vides restent manquantes."""
+    def canonique(v):
+        if isinstance(v, (int, np.integer)) and not isinstance(v, bool):
+            return str(int(v))
+        if isinstance(v, (float, np.floating)) and float(v).is_integer():
+            return str(int(v))
+        texte = str(v).strip()
+        if texte.endswith(".0") and texte[:-2].isdigit():
+            texte = texte[:-2]
+        return texte or None
+    codes, valeurs = pd.factorize(serie.astype(object), use_na_sentinel=True)
+    table = np.array([canonique(v) for v in valeurs] + [None], dtype=object)
+    return pd.Series(table[codes], index=serie.index, name=serie.name, dtype=object)
+
+def finaliser_onglet(df, role, variante):
+    """Dernières retouches sur l'onglet complet, une fois tous les blocs assemblés."""
+    # Schéma logique fixe : colonnes absentes de la variante ajoutées (valeur par défaut ou vide), ordre commun
+    manquantes = [c for c in COLONNES_ROLES[role] if c not in df.columns]
+    if manquantes:
+        ajout = typer_bloc(pd.DataFrame({c: variante["defauts"].get(c) for c in manquantes}, index=df.index))
+        df = pd.concat([df, ajout], axis=1)
+    df = df.reindex(columns=COLONNES_ROLES[role])
+    # Mémoire de l'onglet en texte brut, avant le schéma compact (panneau de diagnostic)
+    df.attrs["octets_texte"] = int(df.memory_usage(deep=True).sum())
+    # Codes tarifaires nettoyés une fois par code distinct, sur l'onglet entier
+    if role == "prestations":
+        df["code_tarifaire"] = nettoyer_codes(df["code_tarifaire"])
+    # N° de facture canonique avant toute clé de ligne, fusion ou jointure entre exports (catégorie : une
+    # facture compte plusieurs lignes de prestation)
+    df["num_facture"] = normaliser_numeros(df["num_facture"]).astype("category")
+    # Colonnes texte aux types mélangés (ex. 123 et "123A") → texte, pour un stockage Parquet stable
+    for c in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[c], skipna=True).startswith("mixed"):
+            df[c] = df[c].where(df[c].isna(), df[c].astype(str))
+    for c in COLONNES_CATEGORIES:
+        if c in df.columns:
+            df[c] = df[c].astype("category")
+    return df
+
+def lire_onglet_flux(ws, schemas, progression, base, total):
+    """Lit un onglet en mode lecture seule, par blocs de TAILLE_BLOC lignes, en ne gardant que
+    les colonnes utiles. Chaque bloc est typé aussitôt : la mémoire reste proche du résultat final.
+    schemas : {rôle: (variante, positions)} issus de schema_onglet.
+    Retourne {rôle: DataFrame} (un même onglet peut servir aux deux rôles)."""
+    lignes = ws.iter_rows(values_only=True)
+    next(lignes, None)  # en-têtes, déjà résolus
+    roles = list(schemas)
+    a_lire = {role: positions for role, (_, positions) in schemas.items()}
+    positions = sorted({p for cols in a_lire.values() for p in cols.values()})
+    blocs = {role: [] for role in roles}
+
+    def vider(tampon):
+        brut = {p: [ligne[p] if p < len(ligne) else None for ligne in tampon] for p in positions}
+        for role, cols in a_lire.items():
+            blocs[role].append(typer_bloc(pd.DataFrame({cle: brut[p] for cle, p in cols.items()})))
+
+    tampon, nb = [], 0
+    for ligne in lignes:
+        if all(ligne[p] is None for p in positions if p < len(ligne)):
+            continue  # ligne vide
+        tampon.append(ligne)
+        if len(tampon) == TAILLE_BLOC:
+            vider(tampon)
+            nb += len(tampon)
+            tampon = []
+            progression((base + nb) / total, f"{ws.title} : {nb:,} lignes".replace(",", "'"))
+    if tampon or not any(blocs.values()):
+        vider(tampon)
+    return {role: finaliser_onglet(pd.concat(blocs[role], ignore_index=True), role, schemas[role][0]) for role in roles}
+
+def lire_export(f, progression=lambda fraction, texte: None):
+    """Lit un classeur Ephysio une seule fois (lecture seule, en flux) et retourne ses onglets typés.
+    Seuls les onglets Prestation et Factures sont parcourus ; dans un classeur sans onglet nommé
+    (ex. export Factures seul), le rôle du premier onglet est déduit de ses en-têtes.
+    Un onglet qui ne correspond à aucune variante connue n'est pas lu : le motif est gardé dans
+    ds["anomalies"] (voir onglet_export). progression(fraction, texte) est appelée après chaque bloc de lignes."""
+    from openpyxl import load_workbook
+    wb = load_workbook(f, read_only=True, data_only=True)
     try:
-        return pd.to_datetime(str(val).strip(), format="%d.%m.%Y", errors="coerce")
-    except:
-        return pd.to_datetime(val, errors="coerce")
-
-def calculer_liquidites_fournisseur(f_attente, p_hist, jours_horizons):
-    """Calcul de probabilité de paiement pour le module Facturation"""
-    liq = {h: 0.0 for h in jours_horizons}
-    taux_glob = {h: 0.0 for h in jours_horizons}
-    if p_hist.empty: return liq, taux_glob
-    for h in jours_horizons:
-        stats_croisees = p_hist.groupby(["assureur", "fournisseur"])["delai"].apply(lambda x: (x <= h).mean()).to_dict()
-        stats_fourn = p_hist.groupby("fournisseur")["delai"].apply(lambda x: (x <= h).mean()).to_dict()
-        taux_glob[h] = (p_hist["delai"] <= h).mean()
-        total_h = 0.0
-        for _, row in f_attente.iterrows():
-            key = (row["assureur"], row["fournisseur"])
-            prob = stats_croisees.get(key, stats_fourn.get(row["fournisseur"], taux_glob[h]))
-            total_h += row["montant"] * prob
-        liq[h] = total_h
-    return liq, taux_glob
+        onglets = wb.sheetnames
+        ong_prest = trouver_onglet(onglets, "prestation", "prestation")
+        ong_fact  = trouver_onglet(onglets, "factures", "facture")
+        if ong_prest is None and ong_fact is None:
+            a_lire = {onglets[0]: ("prestations", "factures")}
+        else:
+            a_lire = {ong: (role,) for ong, role in ((ong_prest, "prestations"), (ong_fact, "factures")) if ong}
+        total = max(sum(wb[ong].max_row or 0 for ong in a_lire), 1)
+        ds = {"nom": f.name, "onglets": onglets, "prestations": None, "factures": None,
+              "entetes": {"prestations": None, "factures": None}, "octets_texte": {"prestations": None, "factures": None},
+              "variantes": {"prestations": None, "factures": None}, "anomalies": {}}
+        base = 0
+        for ong, roles in a_lire.items():
+            entetes = entetes_onglet(wb[ong])
+            schemas, anomalies = {}, {}
+            for role in roles:
+                try:
+                    schemas[role] = schema_onglet(entetes, role)
+                except ValueError as e:
+                    anomalies[role] = str(e)
+            if len(roles) == 1 or not schemas:
+                ds["anomalies"].update(anomalies)  # onglet sans nom : seuls les rôles reconnus comptent
+            frames = lire_onglet_flux(wb[ong], schemas, progression, base, total) if schemas else {}
+            for role, df in frames.items():
+                ds[role], ds["entetes"][role] = df, list(entetes)
+                ds["octets_texte"][role] = df.attrs["octets_texte"]
+                ds["variantes"][role] = schemas[role][0]["nom"]
+            base += wb[ong].max_row or 0
+    finally:
+        wb.close()
+    return ds
+
+def cle_export(f):
+    """Clé d'un fichier chargé : SHA-256 de son contenu (calculé une fois par fichier déposé)."""
+    empreintes = st.session_state.setdefault("empreintes", {})
+    id_fichier = getattr(f, "file_id", None) or (f.name, f.size)
+    if id_fichier not in empreintes:
+        empreintes[id_fichier] = hashlib.sha256(f.getvalue()).hexdigest()
+    return empreintes[id_fichier]
+
+def lire_cache_export(cle):
+    """Export typé depuis le cache disque, ou None s'il n'y est pas."""
+    dossier = os.path.join(DOSSIER_CACHE, cle)
+    chemin_meta = os.path.join(dossier, "meta.json")
+    if not os.path.exists(chemin_meta):
+        return None
+    with open(chemin_meta, encoding="utf-8") as fm:
+        meta = json.load(fm)
+    if meta.get("version") != VERSION_CACHE:
+        return None
+    ds = {"nom": meta["nom"], "onglets": meta["onglets"], "entetes": meta["entetes"], "octets_texte": meta["octets_texte"],
+          "variantes": meta["variantes"], "anomalies": meta["anomalies"]}
+    for role in ("prestations", "factures"):
+        ds[role] = pd.read_parquet(os.path.join(dossier, f"{role}.parquet")) if meta[role] else None
+    os.utime(chemin_meta)  # dernier accès → éviction LRU
+    return ds
+
+def ecrire_cache_export(cle, ds):
+    """Écrit un export typé dans le cache disque (écriture atomique), puis applique la taille max."""
+    os.makedirs(DOSSIER_CACHE, exist_ok=True)
+    dossier = os.path.join(DOSSIER_CACHE, cle)
+    tmp = f"{dossier}.tmp{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    meta = {"version": VERSION_CACHE, "nom": ds["nom"], "onglets": ds["onglets"], "entetes": ds["entetes"],
+            "octets_texte": ds["octets_texte"], "variantes": ds["variantes"], "anomalies": ds["anomalies"]}
+    for role in ("prestations", "factures"):
+        meta[role] = ds[role] is not None
+        if meta[role]:
+            ds[role].to_parquet(os.path.join(tmp, f"{role}.parquet"), index=False)
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as fm:
+        json.dump(meta, fm)
+    shutil.rmtree(dossier, ignore_errors=True)
+    os.replace(tmp, dossier)
+    purger_cache_exports()
+
+def purger_cache_exports():
+    """Supprime les exports les moins récemment utilisés au-delà de TAILLE_MAX_CACHE_MO."""
+    entrees = []
+    for nom in os.listdir(DOSSIER_CACHE):
+        dossier = os.path.join(DOSSIER_CACHE, nom)
+        chemin_meta = os.path.join(dossier, "meta.json")
+        if not os.path.exists(chemin_meta):
+            continue
+        taille = sum(os.path.getsize(os.path.join(dossier, x)) for x in os.listdir(dossier))
+        entrees.append((os.path.getmtime(chemin_meta), taille, dossier))
+    total = sum(t for _, t, _ in entrees)
+    for _, taille, dossier in sorted(entrees):
+        if total <= TAILLE_MAX_CACHE_MO * 1024 * 1024:
+            break
+        shutil.rmtree(dossier, ignore_errors=True)
+        total -= taille
+
+@st.cache_resource
+def pool_lectures():
+    """Fils de lecture partagés par toutes les sessions : un export est lu hors de l'exécution du script,
+    qui se termine aussitôt et laisse la page utilisable. openpyxl étant en Python pur, deux lectures
+    simultanées suffisent."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="lecture-export")
+
+def lancer_lecture(f, cle, actif):
+    """Soumet la lecture (puis l'écriture en cache disque) d'un fichier déposé au pool de lecture.
+    Le fil ne touche pas à Streamlit : il ne met à jour que la progression de st.session_state.lectures[cle]."""
+    contenu = io.BytesIO(f.getvalue())
+    contenu.name = f.name
+    lecture = {"nom": f.name, "actif": actif, "fraction": 0.0, "texte": f"{f.name} : en attente…", "erreur_cache": None}
+
+    def lire():
+        ds = lire_export(contenu, lambda fraction, texte: lecture.update(fraction=min(fraction, 1.0), texte=f"{f.name} — {texte}"))
+        try:
+            ecrire_cache_export(cle, ds)
+        except Exception as e:
+            lecture["erreur_cache"] = e
+        return ds
+
+    lecture["tache"] = pool_lectures().submit(lire)
+    st.session_state.lectures[cle] = lecture
+
+def ajouter_au_registre(cle, ds):
+    """Range un export lu dans le registre de session (et dans la base locale si elle est activée).
+    Au-delà de NB_EXPORTS_MAX, l'export le moins récemment utilisé est retiré, de préférence parmi ceux
+    que le cache disque permet de recharger sans relire le fichier."""
+    registre = st.session_state.exports
+    registre[cle] = ds
+    if base_active():
+        try:
+            enregistrer_export_base(cle, ds)
+        except Exception as e:
+            st.sidebar.caption(f"Base locale indisponible : {e}")
+    while len(registre) > NB_EXPORTS_MAX:
+        anciens = [c for c in registre if c != cle]
+        registre.pop(next((c for c in anciens if os.path.exists(os.path.join(DOSSIER_CACHE, c, "meta.json"))), anciens[0]))
+
+def recuperer_lectures():
+    """Verse dans le registre les lectures en arrière-plan terminées. Une lecture en échec est retirée
+    et son erreur gardée par fichier dans st.session_state.echecs_lecture (signalée par charger_export,
+    sans relancer la lecture) ; les autres lectures terminées sont versées normalement."""
+    for cle, lecture in list(st.session_state.lectures.items()):
+        if not lecture["tache"].done():
+            continue
+        del st.session_state.lectures[cle]
+        erreur = lecture["tache"].exception()
+        if erreur is not None:
+            st.session_state.echecs_lecture[cle] = f"{lecture['nom']} : {erreur}"
+            continue
+        ds = lecture["tache"].result()
+        if lecture["erreur_cache"] is not None:
+            st.sidebar.caption(f"Cache disque indisponible : {lecture['erreur_cache']}")
+        ajouter_au_registre(cle, ds)
+        if lecture["actif"]:
+            st.session_state.export_actif = cle
+
+@st.fragment(run_every=0.5)
+def _barres_lectures():
+    # Seul ce fragment est réexécuté pendant la lecture ; la page entière repart quand tout est lu
+    lectures = st.session_state.lectures
+    if all(lecture["tache"].done() for lecture in lectures.values()):
+        st.rerun()
+    for lecture in lectures.values():
+        st.progress(lecture["fraction"], text=lecture["texte"])
+
+def afficher_lectures():
+    """Progression des lectures en cours dans la sidebar (rien si aucune lecture n'est en cours)."""
+    if st.session_state.lectures:
+        with st.sidebar:
+            _barres_lectures()
+
+def charger_export(f, actif=True):
+    """Export Ephysio depuis le registre de session — le fichier n'est lu qu'au premier appel,
+    et seulement s'il n'est pas déjà dans le cache disque (même contenu déjà chargé auparavant).
+    La lecture se fait en arrière-plan (lancer_lecture) : None est retourné tant qu'elle n'est pas
+    terminée, et la page est relancée automatiquement ensuite.
+    actif=False pour un fichier secondaire qui ne doit pas devenir l'export repris par les autres pages.
+    Un fichier dont la lecture a échoué est signalé dans la sidebar et None est retourné."""
+    recuperer_lectures()
+    registre = st.session_state.exports
+    cle = cle_export(f)
+    if cle in st.session_state.echecs_lecture:
+        st.sidebar.error(f"❌ Lecture impossible — {st.session_state.echecs_lecture[cle]}")
+        return None
+    if cle in registre:
+        registre[cle] = registre.pop(cle)  # plus récemment utilisé → dernier retiré
+    elif cle not in st.session_state.lectures:
+        try:
+            ds = lire_cache_export(cle)
+        except Exception:
+            ds = None  # cache illisible → relecture du fichier
+        if ds is None:
+            lancer_lecture(f, cle, actif)
+        else:
+            ds["nom"] = f.name
+            ajouter_au_registre(cle, ds)
+    if cle not in registre:
+        return None
+    if actif:
+        st.session_state.export_actif = cle
+    return registre[cle]
+
+def export_courant(f, besoins=None):
+    """Export du module : fichier chargé, sinon dernier export lu dans la session (changement de page :
+    les données ne changent pas sous l'utilisateur), sinon base locale (si activée et non vide).
+    besoins : onglets, colonnes et filtres à lire dans la base locale, voir export_base."""
+    en_memoire = st.session_state.exports.get(st.session_state.get("export_actif"))
+    if f is not None:
+        ds = charger_export(f)
+        if ds is None and cle_export(f) in st.session_state.lectures:
+            st.info(f"⏳ Lecture de **{f.name}** en cours — l'analyse démarrera automatiquement.")
+    elif en_memoire is not None:
+        ds = en_memoire
+        st.sidebar.caption(f"📄 Export en mémoire : **{ds['nom']}**")
+    elif base_active() and etat_base()["exports"]:
+        ds = export_base(besoins or {})
+        debuts = [requete["debut"] for requete in (besoins or {}).values() if requete.get("debut") is not None]
+        st.sidebar.caption(f"🗄️ Base locale : **{ds['nb_exports']} export(s)** fusionnés"
+                           + (f" — depuis le {min(debuts).strftime('%d.%m.%Y')}" if debuts else ""))
+    else:
+        ds = None
+    afficher_lectures()
+    afficher_memoire_exports()
+    return ds
+
+def afficher_memoire_exports():
+    """Panneau de diagnostic : mémoire de chaque onglet en session, en texte brut puis avec le schéma compact."""
+    lignes = []
+    for ds in st.session_state.exports.values():
+        for role in ("prestations", "factures"):
+            df = ds[role]
+            if df is None:
+                continue
+            avant = (ds.get("octets_texte") or {}).get(role)
+            apres = int(df.memory_usage(deep=True).sum())
+            lignes.append({"Export": ds["nom"], "Onglet": role, "Variante": (ds.get("variantes") or {}).get(role), "Lignes": len(df),
+                           "Texte (Mo)": round(avant / 1e6, 1) if avant else None,
+                           "Compact (Mo)": round(apres / 1e6, 1),
+                           "Gain": f"{1 - apres / avant:.0%}" if avant else "—"})
+    if not lignes:
+        return
+    with st.sidebar.expander("🧠 Mémoire des exports"):
+        tab = pd.DataFrame(lignes)
+        st.dataframe(tab, hide_index=True, use_container_width=True)
+        st.caption(f"Total en session : {tab['Compact (Mo)'].sum():.1f} Mo")
+        hist = st.session_state.get("historique")
+        if hist is not None and hist["prestations"] is not None:
+            st.caption(f"Historique fusionné : {len(hist['prestations']):,} lignes, "
+                       f"{hist['prestations'].memory_usage(deep=True).sum() / 1e6:.1f} Mo".replace(",", "'"))
+
+# --- HISTORIQUE MULTI-EXPORTS (Pilotage Flux) ---
+def cles_lignes(df):
+    """Clé stable (hachage 64 bits) de chaque ligne de prestation : n° de facture + n° de patient + date
+    + code + rang de la ligne parmi celles de même facture, patient, date et code. Une même ligne présente
+    dans deux exports a la même clé, même si l'un des exports ne contient qu'une partie de la facture
+    (coupure par date), et quel que soit le type lu pour les numéros (forme canonique, voir normaliser_numeros).
+    Le patient fait partie de la clé : un n° de facture réutilisé d'un export à l'autre (autre cabinet,
+    numérotation remise à zéro) pour un autre patient ne fait pas disparaître ses lignes."""
+    factures, patients = normaliser_numeros(df["num_facture"]), normaliser_numeros(df["num_patient"])
+    rang = df.groupby([factures, patients, df["date_facture"], df["code_tarifaire"]],
+                      observed=True, sort=False, dropna=False).cumcount()
+    champs = pd.DataFrame({"facture": factures, "patient": patients, "ligne": rang,
+                           "date": df["date_facture"], "code": df["code_tarifaire"]})
+    return pd.util.hash_pandas_object(champs, index=False).to_numpy()
+
+def concat_categoriel(df_a, df_b):
+    """pd.concat qui conserve les colonnes catégorielles (catégories fusionnées) au lieu de les repasser en texte."""
+    res = pd.concat([df_a, df_b], ignore_index=True)
+    for c in df_a.columns[df_a.dtypes == "category"]:
+        if c in df_b.columns and isinstance(df_b[c].dtype, pd.CategoricalDtype):
+            fusion = pd.api.types.union_categoricals([df_a[c], df_b[c]], sort_categories=True)
+            res[c] = pd.Categorical.from_codes(fusion.codes, fusion.categories)
+        elif res[c].dtype == object:
+            res[c] = res[c].astype("category")
+    return res
+
+def historique_vide():
+    """Historique sans export : exports fusionnés, prestations, clés des lignes connues, doublons écartés, dernière date par export"""
+    return {"exports": [], "prestations": None, "cles_lignes": set(), "doublons": 0, "fin": {}}
+
+def ajouter_a_historique(hist, cle, df):
+    """Ajoute à l'historique les seules lignes de df absentes (clé de ligne inconnue).
+    Les clés déjà fusionnées sont gardées dans un ensemble : la recherche des doublons est proportionnelle
+    à l'export ajouté. La concaténation recopie en revanche l'historique fusionné (une fois par export ajouté)."""
+    cles = cles_lignes(df).tolist()
+    connues = hist["cles_lignes"]
+    nouvelles = np.fromiter((c not in connues for c in cles), dtype=bool, count=len(cles))
+    ajout = df[nouvelles]
+    hist["prestations"] = ajout.reset_index(drop=True) if hist["prestations"] is None else concat_categoriel(hist["prestations"], ajout)
+    connues.update(c for c, n in zip(cles, nouvelles) if n)
+    hist["doublons"] += int((~nouvelles).sum())
+    hist["exports"].append(cle)
+    hist["fin"][cle] = df["date_facture"].max()
+
+def historique_prestations(sources):
+    """Historique des prestations fusionné à partir de plusieurs exports qui peuvent se chevaucher.
+    sources : liste de (clé de l'export, fonction qui retourne l'export). Les exports déjà fusionnés
+    ne sont pas relus ; si un export a été retiré, l'historique est reconstruit. Un export encore en
+    cours de lecture (fonction qui retourne None) est laissé de côté jusqu'à la prochaine exécution."""
+    hist = st.session_state.get("historique")
+    cles = [cle for cle, _ in sources]
+    if hist is None or not set(hist["exports"]) <= set(cles):
+        hist = historique_vide()
+    for cle, charger in sources:
+        if cle in hist["exports"]:
+            continue
+        ds = charger()
+        if ds is None:
+            continue
+        ajouter_a_historique(hist, cle, onglet_export(ds, "prestations"))
+    st.session_state.historique = hist
+    return hist
+
+# --- BASE LOCALE (optionnelle) ---
+# Mêmes colonnes logiques que resoudre_colonnes ; dates en texte ISO (comparables dans SQLite)
+COLONNES_BASE = list(resoudre_colonnes([]).keys())
+
+def _ddl_colonnes():
+    types = {**{c: "TEXT" for c in COLONNES_DATES}, **{c: "REAL" for c in COLONNES_MONTANTS + COLONNES_QUANTITES}}
+    return ", ".join(f"{c} {types.get(c, '')}".strip() for c in COLONNES_BASE)
+
+SCHEMA_BASE = f"""
+CREATE TABLE IF NOT EXISTS prestations (cle INTEGER PRIMARY KEY, {_ddl_colonnes()});
+CREATE INDEX IF NOT EXISTS ix_prestations_date ON prestations(date_facture);
+CREATE TABLE IF NOT EXISTS factures (cle INTEGER PRIMARY KEY, maj TEXT, {_ddl_colonnes()});
+CREATE INDEX IF NOT EXISTS ix_factures_date ON factures(date_facture);
+CREATE TABLE IF NOT EXISTS exports (cle TEXT PRIMARY KEY, nom TEXT, importe_le TEXT, lignes_prestations INTEGER, lignes_factures INTEGER);
+"""
+
+def base_active():
+    return bool(CHEMIN_BASE)
+
+@contextmanager
+def base():
+    """Connexion à la base locale, schéma créé si besoin ; validée à la sortie du bloc."""
+    con = sqlite3.connect(os.path.expanduser(CHEMIN_BASE))
+    try:
+        con.executescript(SCHEMA_BASE)
+        with con:
+            yield con
+    finally:
+        con.close()
+
+def _vers_base(df):
+    """Colonnes logiques d'un onglet typé, converties en valeurs SQLite (dates ISO, catégories en texte, NaN → NULL)."""
+    out = pd.DataFrame(index=df.index)
+    for c in COLONNES_BASE:
+        if c not in df.columns:
+            continue
+        if pd.api.types.is_datetime64_any_dtype(df[c]):
+            out[c] = df[c].dt.strftime("%Y-%m-%d %H:%M:%S")
+        else:
+            out[c] = df[c].astype(object)
+    return out.where(out.notna(), None)
+
+def enregistrer_export_base(cle, ds):
+    """Verse un export dans la base locale (une fois par fichier). Les lignes de prestation déjà présentes
+    sont ignorées (même clé de ligne que l'historique) ; une facture déjà connue (même n° canonique, quel que
+    soit le type lu dans l'export) est mise à jour si
+    l'export est au moins aussi récent (statut et date de paiement évoluent d'un export à l'autre)."""
+    with base() as con:
+        if con.execute("SELECT 1 FROM exports WHERE cle = ?", (cle,)).fetchone():
+            return
+        prest, fact = ds["prestations"], ds["factures"]
+        nb_p = nb_f = 0
+        if prest is not None:
+            lignes = _vers_base(prest).assign(cle=cles_lignes(prest).view("int64"))
+            lignes.to_sql("_import", con, if_exists="replace", index=False)
+            cols = ", ".join(lignes.columns)
+            nb_p = con.execute(f"INSERT OR IGNORE INTO prestations ({cols}) SELECT {cols} FROM _import").rowcount
+        if fact is not None:
+            factures = normaliser_numeros(fact["num_facture"])
+            rang = fact.groupby(factures, sort=False, dropna=False).cumcount()
+            cles = pd.util.hash_pandas_object(pd.DataFrame({"facture": factures, "ligne": rang}), index=False)
+            lignes = _vers_base(fact).assign(cle=cles.to_numpy().view("int64"), maj=str(fact["date_facture"].max()))
+            lignes.to_sql("_import", con, if_exists="replace", index=False)
+            cols = ", ".join(lignes.columns)
+            maj = ", ".join(f"{c} = excluded.{c}" for c in lignes.columns if c != "cle")
+            nb_f = con.execute(f"INSERT INTO factures ({cols}) SELECT {cols} FROM _import WHERE true "
+                               f"ON CONFLICT(cle) DO UPDATE SET {maj} WHERE excluded.maj >= factures.maj").rowcount
+        con.execute("DROP TABLE IF EXISTS _import")
+        con.execute("INSERT INTO exports VALUES (?, ?, ?, ?, ?)",
+                    (cle, ds["nom"], str(pd.Timestamp.now().floor("s")), nb_p, nb_f))
+
+def etat_base():
+    """Volumes et étendue de la base locale (requêtes d'agrégat, rien n'est chargé)."""
+    with base() as con:
+        etat = {"exports": con.execute("SELECT COUNT(*) FROM exports").fetchone()[0]}
+        for table in ("prestations", "factures"):
+            n, debut, fin = con.execute(f"SELECT COUNT(*), MIN(date_facture), MAX(date_facture) FROM {table}").fetchone()
+            etat[table] = {"lignes": n, "debut": pd.to_datetime(debut), "fin": pd.to_datetime(fin)}
+    etat["empreinte"] = f"{etat['exports']}-{etat['prestations']['lignes']}-{etat['factures']['lignes']}"
+    return etat
+
+def typer_base(df):
+    """Applique à un résultat SQL le même schéma compact qu'à l'ingestion d'un export."""
+    for c in df.columns:
+        if c in COLONNES_DATES:
+            df[c] = pd.to_datetime(df[c], format="%Y-%m-%d %H:%M:%S", errors="coerce")
+        elif c in COLONNES_MONTANTS:
+            df[c] = df[c].astype("float64")
+        elif c in COLONNES_QUANTITES:
+            df[c] = df[c].astype("float32")
+        elif c in COLONNES_CATEGORIES or c == "code_tarifaire":
+            df[c] = df[c].astype("category")
+        elif c == "num_facture":
+            # Lignes versées avant la forme canonique : n° éventuellement stockés en nombres
+            df[c] = normaliser_numeros(df[c]).astype("category")
+    return df
+
+def lire_base(table, colonnes, debut=None, fin=None, conditions=()):
+    """Lit dans la base locale les seules colonnes demandées, filtrées dans SQLite :
+    date_facture dans [debut, fin[ et conditions SQL supplémentaires (ex. "chiffre > 0")."""
+    clauses, params = list(conditions), []
+    if debut is not None:
+        clauses.append("date_facture >= ?")
+        params.append(str(pd.Timestamp(debut)))
+    if fin is not None:
+        clauses.append("date_facture < ?")
+        params.append(str(pd.Timestamp(fin)))
+    sql = f"SELECT {', '.join(colonnes)} FROM {table}" + (" WHERE " + " AND ".join(clauses) if clauses else "")
+    with base() as con:
+        return typer_base(pd.read_sql_query(sql, con, params=params))
+
+def annees_base(table):
+    """Années présentes dans une table de la base locale, de la plus récente à la plus ancienne."""
+    with base() as con:
+        lignes = con.execute(f"SELECT DISTINCT CAST(substr(date_facture, 1, 4) AS INTEGER) FROM {table} "
+                             "WHERE date_facture IS NOT NULL ORDER BY 1 DESC").fetchall()
+    return [a for (a,) in lignes]
+
+def export_base(besoins):
+    """Équivalent d'un export lu depuis la base locale : seuls les onglets et colonnes listés dans
+    besoins ({rôle: {"colonnes": [...], "conditions": [...], "debut": ..., "fin": ...}}) sont chargés."""
+    etat = etat_base()
+    ds = {"nom": "Base locale", "base": True, "cle": f"base:{etat['empreinte']}", "nb_exports": etat["exports"],
+          "onglets": ["Prestation", "Factures"], "prestations": None, "factures": None}
+    for role, requete in besoins.items():
+        if etat[role]["lignes"]:
+            ds[role] = lire_base(role, **requete)
+    return ds
+
+def debut_fenetre_base(annees=ANNEES_BASE_PERFORMANCE):
+    """Premier jour du mois d'il y a `annees` ans : début de la fenêtre lue dans la base locale."""
+    return (pd.Timestamp(datetime.today().date()) - pd.DateOffset(years=annees)).replace(day=1)
+
+def lire_config_base(nom):
+    """Table de configuration sauvegardée dans la base locale (None si absente ou base désactivée)."""
+    if not base_active():
+        return None
+    try:
+        with base() as con:
+            return pd.read_sql_query(f'SELECT * FROM "{nom}"', con)
+    except Exception:
+        return None
+
+def ecrire_config_base(nom, df):
+    """Remplace une table de configuration dans la base locale (sans effet si la base est désactivée)."""
+    if base_active():
+        with base() as con:
+            df.to_sql(nom, con, if_exists="replace", index=False)
+
+# ==========================================
+# 📈 ANALYSE DU FLUX PATIENTS (ÉTAPES EN CACHE)
+# ==========================================
+# Chaque étape n'est mise en cache que sur ses propres entrées : _df (historique fusionné) n'est pas haché
+# par Streamlit, les clés des exports fusionnés (cles) l'identifient. Une étape appelle elle-même les
+# étapes dont elle dépend, qui ne sont donc relues du cache que si elle doit être recalculée :
+#   événements → épisodes (delai_fin) → chroniques (+ jours ouvrés)
+#   événements → nouveaux (delai_fin) → recrutement (+ jours ouvrés)
+#   CA journalier → jours ouvrés (seuil_jour)
+
+# Épisode chronique : au moins SEANCES_CHRONIQUE séances ou au moins JOURS_CHRONIQUE jours de traitement
+SEANCES_CHRONIQUE = 45
+JOURS_CHRONIQUE = 365
+
+def episodes_chroniques(df_ep, jusqu_au=None):
+    """Masque des épisodes chroniques (règle commune aux chroniques actifs et à la charge par thérapeute).
+    La durée court du début de l'épisode jusqu'à jusqu_au (défaut : sa dernière séance)."""
+    fin = df_ep["fin"] if jusqu_au is None else jusqu_au
+    return (df_ep["nb_seances"] >= SEANCES_CHRONIQUE) | ((fin - df_ep["debut"]).dt.days >= JOURS_CHRONIQUE)
+
+@st.cache_data
+def flux_evenements(_df, cles):
+    """Table des événements utiles au flux (une ligne par date, patient et type), triée par date.
+    Trois flux séparés selon la logique de détection :
+    - 7350 : bilan premier traitement (source principale)
+    - 7301/7311 : garde uniquement pour le rythme et la moyenne séances
+    - 25.110 : première apparition du patient (traitements courts)"""
+    c_date, c_tarif, c_pat, c_mont = "date_facture", "code_tarifaire", "num_patient", "chiffre"
+    df = _df[[c_date, c_tarif, c_pat, c_mont]]
+    df_pos = df[df[c_mont].fillna(0) > 0].dropna(subset=[c_date, c_pat])
+
+    df_7350 = df_pos[df_pos[c_tarif] == "7350"][[c_date, c_pat]].rename(columns={c_date: "_date", c_pat: "_pat"})
+    df_7350["_type"] = "7350"
+
+    df_physio = df_pos[df_pos[c_tarif].isin(["7301", "7311"])][[c_date, c_pat]].rename(columns={c_date: "_date", c_pat: "_pat"})
+    df_physio["_type"] = "physio"
+
+    df_25 = df_pos[df_pos[c_tarif] == "25.110"][[c_date, c_pat]].rename(columns={c_date: "_date", c_pat: "_pat"})
+    df_25["_type"] = "25.110"
+
+    df_f = pd.concat([df_7350, df_physio, df_25]).drop_duplicates(subset=["_date", "_pat", "_type"])
+    return df_f.sort_values("_date")
+
+@st.cache_data
+def flux_bornes(_df, cles):
+    """Première et dernière date de la table des événements."""
+    df_f = flux_evenements(_df, cles)
+    return df_f["_date"].min(), df_f["_date"].max()
+
+@st.cache_data
+def flux_ca_jour(_df, cles):
+    """CA journalier sur TOUTES les prestations (pour jours ouvrés réels)."""
+    ca = _df.loc[_df["chiffre"].fillna(0) > 0, ["date_facture", "chiffre"]]
+    return ca["chiffre"].groupby(ca["date_facture"].dt.normalize()).sum()
+
+@st.cache_data
+def flux_calendrier(_df, cles, seuil_jour):
+    """Jours ouvrés réels : jours où le CA total >= seuil_jour."""
+    ca_jour = flux_ca_jour(_df, cles)
+    return calendrier_ouverture(ca_jour.index.to_series(), ca_jour, seuil_jour)
+
+@st.cache_data
+def flux_episodes(_df, cles, delai_fin):
+    """Découpage des séances 7301/7311 en épisodes de traitement, rythme hebdomadaire et moyenne séances/traitement."""
+    df_f = flux_evenements(_df, cles)
+    _, derniere_date = flux_bornes(_df, cles)
+    df_physio = df_f[df_f["_type"] == "physio"].assign(_semaine=lambda d: semaines_iso(d["_date"]))
+
+    # --- 1. DÉCOUPAGE EN ÉPISODES DE TRAITEMENT ---
+    # Un épisode = séquence continue de séances 7301/7311 sans pause > PAUSE_TRAITEMENT jours.
+    # Le 7350 est refacturé tous les 36 séances ou 6 mois pour des raisons admin,
+    # il ne marque donc PAS le début d'un nouveau traitement.
+    PAUSE_TRAITEMENT = delai_fin  # paramètre utilisateur (défaut 60j)
+
+    # Un seul passage : séances triées par patient puis date, nouvel épisode au changement de patient
+    # ou après une pause > PAUSE_TRAITEMENT jours, identifiant d'épisode = somme cumulée des ruptures.
+    seances = df_physio[["_pat", "_date", "_semaine"]].sort_values(["_pat", "_date"])
+    rupture = (seances["_pat"] != seances["_pat"].shift()) | (seances["_date"].diff().dt.days > PAUSE_TRAITEMENT)
+    df_ep = seances.assign(_ep=rupture.cumsum()).groupby("_ep").agg(
+        _pat=("_pat", "first"),
+        debut=("_date", "min"),
+        fin=("_date", "max"),
+        nb_seances=("_date", "size"),
+        nb_semaines=("_semaine", "nunique"),
+    ).reset_index(drop=True)
+
+    # --- 2. RYTHME HEBDOMADAIRE (semaines actives par épisode) ---
+    # Pour chaque épisode, on compte les semaines ISO distinctes avec au moins une séance.
+    ep_rythme = df_ep[(df_ep["nb_seances"] >= 2) & (df_ep["nb_semaines"] >= 2)]
+    rythmes_ep = ep_rythme["nb_seances"] / ep_rythme["nb_semaines"]
+
+    rythme = rythmes_ep.mean() if not rythmes_ep.empty else 1.1
+
+    # Épisodes terminés : fin plus ancienne que delai_fin jours avant la dernière date
+    seuil_termine = derniere_date - timedelta(days=delai_fin)
+    ep_termines = df_ep[df_ep["fin"] <= seuil_termine]
+
+    # Moyenne séances/traitement = épisodes terminés NON chroniques
+    # + pour les chroniques on utilise une estimation haute (nb séances actuelles)
+    # car on ne connaît pas leur fin → on les note séparément
+    moy_seances = ep_termines['nb_seances'].mean() if not ep_termines.empty else df_ep['nb_seances'].mean()
+    return {"episodes": df_ep, "rythme_reel": rythme, "moy_seances": moy_seances, "nb_termines": len(ep_termines)}
+
+@st.cache_data
+def flux_chroniques(_df, cles, delai_fin, seuil_jour):
+    """Patients chroniques actifs et leur cadence hebdomadaire récente (RDV/semaine occupés en permanence)."""
+    df_f = flux_evenements(_df, cles)
+    df_ep = flux_episodes(_df, cles, delai_fin)["episodes"]
+    _, derniere_date = flux_bornes(_df, cles)
+
+    # --- 3. CHRONIQUES ---
+    seuil_termine = derniere_date - timedelta(days=delai_fin)
+    # Épisodes encore actifs (fin récente = en cours)
+    ep_en_cours = df_ep[df_ep["fin"] > seuil_termine]
+
+    # Chroniques actifs = épisodes en cours chroniques, la durée étant comptée jusqu'à la dernière date
+    # (en traitement depuis au moins JOURS_CHRONIQUE jours, ou au moins SEANCES_CHRONIQUE séances)
+    chroniques_actifs = ep_en_cours[episodes_chroniques(ep_en_cours, derniere_date)]
+
+    # Cadence hebdomadaire des chroniques (sur les 60 derniers jours de l'export)
+    # = nombre moyen de séances/semaine par chronique récemment
+    seuil_60 = derniere_date - timedelta(days=60)
+    jo_60_flux = jours_ouvres(seuil_60, derniere_date, flux_calendrier(_df, cles, seuil_jour))
+    semaines_90 = jo_60_flux / 5  # semaines ouvrées
+    seances_chroniques_90 = df_f[
+        (df_f["_type"] == "physio") &
+        df_f["_pat"].isin(chroniques_actifs["_pat"]) &
+        (df_f["_date"] >= seuil_60)
+    ]
+    rdv_chron_sem = (len(seances_chroniques_90) / semaines_90) if semaines_90 > 0 else 0
+    return {"nb_chroniques": len(chroniques_actifs), "rdv_chron_sem": rdv_chron_sem}
+
+@st.cache_data
+def flux_nouveaux(_df, cles, delai_fin):
+    """Nouveaux patients par jour (7350 hors fantômes + 25.110).
+    Logique par code :
+    - 7350 : bilan premier traitement → nouveau si le patient n'a PAS de séance
+      7301/7311 dans les <delai_fin> jours AVANT la date du 7350
+      (évite de compter un patient qui reprend un 2e traitement comme nouveau)
+    - 25.110 : première apparition du patient (traitements courts, pas de biais fantôme)"""
+    df_f = flux_evenements(_df, cles)
+    premiere_date, _ = flux_bornes(_df, cles)
+    df_physio = df_f[df_f["_type"] == "physio"]
+    df_7350 = df_f[df_f["_type"] == "7350"]
+    df_25 = df_f[df_f["_type"] == "25.110"]
+    seuil_fantomes = premiere_date + timedelta(days=28)
+
+    # Antécédents en un seul appel : pour chaque bilan, dernière séance 7301/7311 du même patient
+    # strictement avant sa date (recherche triée par patient et date, séances déjà triées par date).
+    # Bilan vraiment nouveau si aucune séance dans les <delai_fin> jours qui le précèdent.
+    bilans = df_7350.sort_values("_date")
+    anterieures = pd.merge_asof(
+        bilans[["_date", "_pat"]],
+        df_physio[["_date", "_pat"]].assign(_seance_prec=lambda d: d["_date"]),
+        on="_date", by="_pat", direction="backward", allow_exact_matches=False,
+    )
+    vraiment_nouveau = anterieures["_seance_prec"].isna() | \
+                       (anterieures["_seance_prec"] < anterieures["_date"] - timedelta(days=delai_fin))
+
+    # Pas de drop_duplicates : un patient peut avoir plusieurs traitements distincts.
+    # vraiment_nouveau écarte déjà les 7350 d'un épisode en cours.
+    nouveaux_7350 = bilans[vraiment_nouveau.to_numpy()]
+
+    # 25.110 : première séance du patient par traitement distinct
+    # On garde la première apparition uniquement (pas de code bilan disponible)
+    nouveaux_25 = df_25.sort_values("_date").drop_duplicates(subset=["_pat"], keep="first")
+
+    n_7350_jour = nouveaux_7350.loc[nouveaux_7350["_date"] > seuil_fantomes, "_date"].dt.normalize().value_counts()
+    n_25_jour = nouveaux_25["_date"].dt.normalize().value_counts()
+    return n_7350_jour.add(n_25_jour, fill_value=0).astype(int).sort_index()
+
+@st.cache_data
+def flux_recrutement(_df, cles, delai_fin, seuil_jour):
+    """Index de recrutement journalier et flux des 30/60/120/365 derniers jours.
+    Une ligne par jour (depuis le premier jour ouvré ou la première séance) : nouveaux patients
+    (7350 hors fantômes + 25.110) et jour ouvré. Avec les sommes cumulées, le nombre de nouveaux
+    et de jours ouvrés d'une fenêtre quelconque se lit par simple différence de deux cumuls."""
+    premiere_date, derniere_date = flux_bornes(_df, cles)
+    calendrier = flux_calendrier(_df, cles, seuil_jour)
+    nouveaux_jour = flux_nouveaux(_df, cles, delai_fin)
+
+    debut_index = min(premiere_date.normalize(), calendrier["origine"])
+    jours_index = pd.date_range(debut_index, derniere_date.normalize())
+    recrutement = pd.DataFrame({
+        "nouveaux": nouveaux_jour.reindex(jours_index, fill_value=0),
+        "ouvert": ouvertures(calendrier, jours_index),
+    }, index=jours_index)
+    recrutement["cumul_nouveaux"] = recrutement["nouveaux"].cumsum()
+    recrutement["cumul_ouverts"] = recrutement["ouvert"].cumsum()
+    cumul_nouveaux = np.concatenate([[0], recrutement["cumul_nouveaux"].to_numpy()])
+    cumul_ouverts = np.concatenate([[0], recrutement["cumul_ouverts"].to_numpy()])
+
+    def stats_periode(jours):
+        # Fenêtre [derniere_date - jours ; derniere_date], bornes incluses (comme jours_ouvres)
+        debut = max(len(jours_index) - 1 - jours, 0)
+        count = int(cumul_nouveaux[-1] - cumul_nouveaux[debut])
+        jo = max(int(cumul_ouverts[-1] - cumul_ouverts[debut]), 1)
+        return count, count / jo if jo > 0 else 0
+
+    resultat = {f"flux_{j}": stats_periode(j) for j in (30, 60, 120, 365)}
+    resultat["recrutement"] = recrutement
+    return resultat
+
+@st.cache_data
+def flux_charge_therapeutes(_df, cles, delai_fin):
+    """Charge hebdomadaire par thérapeute, en un seul regroupement sur les séances 7301/7311 :
+    séances (patient × jour), patients distincts et séances de patients chroniques.
+    Une séance est chronique si son épisode de traitement l'est (episodes_chroniques, même règle que
+    les chroniques actifs). Retourne une ligne par (semaine, thérapeute), semaine = lundi."""
+    df = _df[["date_facture", "code_tarifaire", "therapeute", "num_patient", "chiffre"]]
+    seances = df[(df["chiffre"].fillna(0) > 0) & df["code_tarifaire"].isin(["7301", "7311"])] \
+        .dropna(subset=["date_facture", "therapeute", "num_patient"]) \
+        .drop_duplicates(subset=["date_facture", "num_patient", "therapeute"]) \
+        .rename(columns={"date_facture": "_date", "num_patient": "_pat"})
+    colonnes = ["semaine", "therapeute", "seances", "patients", "seances_chroniques", "part_chroniques"]
+    if seances.empty:
+        return pd.DataFrame(columns=colonnes)
+
+    # Épisode de chaque séance : le dernier épisode du patient commencé au plus tard ce jour-là
+    df_ep = flux_episodes(_df, cles, delai_fin)["episodes"]
+    ep = df_ep.assign(_chronique=episodes_chroniques(df_ep))
+    seances = pd.merge_asof(
+        seances[["_date", "_pat", "therapeute"]].sort_values("_date"),
+        ep[["debut", "_pat", "_chronique"]].sort_values("debut"),
+        left_on="_date", right_on="debut", by="_pat", direction="backward",
+    )
+    seances["_chronique"] = seances["_chronique"].eq(True)
+    seances["semaine"] = seances["_date"].dt.normalize() - pd.to_timedelta(seances["_date"].dt.weekday, unit="D")
+    charge = seances.groupby(["semaine", "therapeute"], observed=True).agg(
+        seances=("_pat", "size"),
+        patients=("_pat", "nunique"),
+        seances_chroniques=("_chronique", "sum"),
+    ).reset_index()
+    charge["therapeute"] = charge["therapeute"].astype(str)
+    charge["part_chroniques"] = charge["seances_chroniques"] / charge["seances"]
+    return charge[colonnes]
+
+def capacite_mesuree(charge, derniere_date, cabinets=None):
+    """Table de capacité (format capa_df) déduite de la charge mesurée sur les 52 dernières semaines :
+    Places/Sem = 90e centile des séances des semaines travaillées (semaines pleines), Semaines/an = semaines
+    travaillées. cabinets : {thérapeute: cabinet} repris de la configuration existante (A par défaut)."""
+    recente = charge[charge["semaine"] > derniere_date - timedelta(weeks=52)]
+    par_ther = recente.groupby("therapeute")["seances"].agg(
+        places=lambda s: s.quantile(0.9), semaines="size",
+    ).sort_values("places", ascending=False)
+    cabinets = cabinets or {}
+    return pd.DataFrame({
+        "Thérapeute": par_ther.index,
+        "Cabinet": [cabinets.get(t, "A") for t in par_ther.index],
+        "Places/Sem": par_ther["places"].round().astype(int).to_numpy(),
+        "Semaines/an": par_ther["semaines"].to_numpy(),
+    })
+
+SEMAINES_COHORTE = 52  # horizon des courbes de maintien (semaines depuis le début du traitement)
+
+def cohortes_mensuelles(df_ep, charger_seances, premiere_date, derniere_date, delai_fin, memo):
+    """Matrices de cohortes mensuelles de nouveaux traitements (épisodes commencés dans le mois, hors fantômes) :
+    part encore en traitement et séances par patient, semaine par semaine depuis le début (0..SEMAINES_COHORTE).
+    Une cellule n'est renseignée que si toute la cohorte a pu être observée jusqu'à cette semaine.
+    memo ({mois: (empreinte, ligne maintien, ligne séances, taille)}, gardé en session) est mis à jour sur place :
+    seuls les mois dont l'empreinte (épisodes de la cohorte, statut en cours, horizon observé) a changé,
+    typiquement les plus récents après l'ajout d'un export, sont recalculés ; les séances 7301/7311
+    (charger_seances, appelée seulement dans ce cas) ne sont lues qu'à partir du plus ancien de ces mois.
+    Retourne (maintien, seances, patients) indexés par mois."""
+    seuil_fantomes = premiere_date + timedelta(days=28)
+    ep = df_ep[df_ep["debut"] > seuil_fantomes].assign(
+        _mois=lambda d: d["debut"].dt.to_period("M"),
+        _en_cours=lambda d: d["fin"] > derniere_date - timedelta(days=delai_fin),
+    )
+    # Horizon observé de chaque mois : semaines complètes entre la fin du mois et la dernière date
+    mois = pd.PeriodIndex(sorted(ep["_mois"].unique()), freq="M")
+    fins_mois = mois.to_timestamp(how="end").normalize()
+    horizon = pd.Series(np.clip((derniere_date - fins_mois).days // 7, -1, SEMAINES_COHORTE), index=mois)
+    empreintes = pd.util.hash_pandas_object(ep[["_pat", "debut", "fin", "nb_seances", "_en_cours"]], index=False) \
+                   .groupby(ep["_mois"].to_numpy()).sum()
+    empreintes = {m: (int(empreintes[m]), int(horizon[m])) for m in mois}
+    for m in [m for m in list(memo) if m not in empreintes]:
+        del memo[m]
+    a_calculer = [m for m in mois if m not in memo or memo[m][0] != empreintes[m]]
+
+    if a_calculer:
+        semaines = np.arange(SEMAINES_COHORTE + 1)
+        ep_calc = ep[ep["_mois"].isin(a_calculer)]
+        df_physio = charger_seances()
+        # Séances des seuls épisodes à recalculer : rattachées à leur épisode (dernier début <= date, même patient)
+        seances = pd.merge_asof(
+            df_physio.loc[df_physio["_date"] >= ep_calc["debut"].min(), ["_date", "_pat"]].sort_values("_date"),
+            ep_calc[["debut", "fin", "_pat", "_mois"]].sort_values("debut"),
+            left_on="_date", right_on="debut", by="_pat", direction="backward",
+        ).dropna(subset=["debut"])
+        seances = seances[seances["_date"] <= seances["fin"]]
+        seances["_semaine"] = (seances["_date"] - seances["debut"]).dt.days // 7
+        seances = seances[seances["_semaine"] <= SEMAINES_COHORTE]
+        nb_seances = seances.groupby(["_mois", "_semaine"]).size().unstack(fill_value=0) \
+                            .reindex(index=a_calculer, columns=semaines, fill_value=0)
+        # Encore en traitement après N semaines : épisode poursuivi au moins N semaines, ou toujours en cours
+        duree = ((ep_calc["fin"] - ep_calc["debut"]).dt.days // 7).to_numpy()
+        actifs = (duree[:, None] >= semaines[None, :]) | ep_calc["_en_cours"].to_numpy()[:, None]
+        part_actifs = pd.DataFrame(actifs, index=ep_calc["_mois"].to_numpy()).groupby(level=0).mean()
+        taille = ep_calc["_mois"].value_counts()
+        for m in a_calculer:
+            observe = semaines <= horizon[m]
+            memo[m] = (
+                empreintes[m],
+                np.where(observe, part_actifs.loc[m].to_numpy(), np.nan),
+                np.where(observe, nb_seances.loc[m].to_numpy() / taille[m], np.nan),
+                int(taille[m]),
+            )
 
+    maintien = pd.DataFrame([memo[m][1] for m in mois], index=mois.astype(str))
+    seances_sem = pd.DataFrame([memo[m][2] for m in mois], index=mois.astype(str))
+    patients = pd.Series([memo[m][3] for m in mois], index=mois.astype(str))
+    return maintien, seances_sem, patients
+
+@st.cache_data
+def get_full_analysis(_df, cles, delai_fin, seuil_jour):
+    """Synthèse du flux patients assemblée à partir des étapes en cache."""
+    premiere_date, derniere_date = flux_bornes(_df, cles)
+    episodes = flux_episodes(_df, cles, delai_fin)
+    return {
+        "moy_seances": episodes["moy_seances"],
+        "nb_termines": episodes["nb_termines"],
+        "rythme_reel": episodes["rythme_reel"],
+        **flux_recrutement(_df, cles, delai_fin, seuil_jour),
+        "derniere_date": derniere_date,
+        "premiere_date": premiere_date,
+        "nb_fichiers": len(cles),
+        "delai_fin": delai_fin,
+        **flux_chroniques(_df, cles, delai_fin, seuil_jour),
+    }
+
+# ==========================================
 # 👥 MODULE : PILOTAGE FLUX
 # ==========================================
 def render_stats_patients():
@@ -315,8 +1581,11 @@ def render_stats_patients():
 
     st.sidebar.markdown("---")
     st.sidebar.markdown("**📂 Fichier(s) de prestations**")
-    uploaded_file  = st.sidebar.file_uploader("Export récent (obligatoire)", type="xlsx", key="uploader_flux_1")
-    uploaded_file2 = st.sidebar.file_uploader("Export plus ancien (optionnel, pour étendre l'historique)", type="xlsx", key="uploader_flux_2")
+    fichiers = st.sidebar.file_uploader(
+        "Exports Ephysio (un ou plusieurs)", type="xlsx", key="uploader_flux_1", accept_multiple_files=True,
+        help="Déposez autant d'exports que nécessaire (ex. un par mois ou par année) : les périodes peuvent se chevaucher, "
+             "chaque ligne de prestation n'est comptée qu'une fois."
+    )
     st.sidebar.markdown("---")
     st.sidebar.markdown("**⚙️ Paramètres**")
     delai_fin_traitement = st.sidebar.number_input(
@@ -336,238 +1605,48 @@ def render_stats_patients():
     </div>''', unsafe_allow_html=True)
     st.title("👥 Pilotage du Flux Patients")
 
-    if not uploaded_file:
-        st.info("👋 Chargez au moins le fichier récent pour activer l'analyse.")
+    if fichiers:
+        sources = [(cle_export(f), lambda f=f: charger_export(f, actif=False)) for f in fichiers]
+    elif st.session_state.get("export_actif") in (st.session_state.get("historique") or {}).get("exports", []):
+        # Retour sur la page : l'historique déjà fusionné est repris tel quel, rien à relire
+        sources = [(cle, None) for cle in st.session_state.historique["exports"]]
+        st.sidebar.caption(f"📄 Historique en mémoire : **{len(sources)} export(s)**")
+        afficher_memoire_exports()
+    else:
+        ds_actif = export_courant(None, {"prestations": {"colonnes": ["num_facture", "date_facture", "code_tarifaire", "therapeute", "num_patient", "chiffre"]}})
+        sources = [(ds_actif.get("cle") or st.session_state.export_actif, lambda: ds_actif)] if ds_actif is not None else []
+    if not sources:
+        st.info("👋 Chargez au moins un export de prestations pour activer l'analyse.")
         return
 
     try:
-        @st.cache_data
-        def lire_prestations(f):
-            onglets = pd.ExcelFile(f).sheet_names
-            ong = next((s for s in onglets if s.strip().lower() == 'prestation'), None) or                   next((s for s in onglets if 'prestation' in s.lower()), onglets[0])
-            df = pd.read_excel(f, sheet_name=ong)
-            df.columns = [str(c).strip() for c in df.columns]
-            col_code = df.columns[2]
-            df[col_code] = df[col_code].apply(nettoyer_code_tarif)
-            return df
-
-        @st.cache_data
-        def get_full_analysis(file1, file2, delai_fin, seuil_jour):
-            def parser(f):
-                df = lire_prestations(f)
-                _csp = resoudre_colonnes(df)
-                c_date  = _csp["date_facture"]
-                c_tarif = df.columns[2]   # Code tarifaire — position stable col 2 dans Prestations
-                c_pat   = _csp["num_patient"] or df.columns[8]
-                c_mont  = _csp["chiffre"] or df.columns[11]
-                df[c_date] = pd.to_datetime(df[c_date], errors='coerce')
-                df[c_tarif] = df[c_tarif].astype(str).str.strip()
-                df[c_mont] = pd.to_numeric(df[c_mont], errors='coerce').fillna(0)
-                # CA journalier sur TOUTES les prestations (pour jours ouvrés réels)
-                ca_jour = df[df[c_mont] > 0].dropna(subset=[c_date]).copy()
-                ca_jour = ca_jour.groupby(ca_jour[c_date].dt.date)[c_mont].sum()
-                # Trois flux séparés selon la logique de détection :
-                # - 7350 : bilan premier traitement (source principale)
-                # - 7301/7311 : garde uniquement pour le rythme et la moyenne séances
-                # - 25.110 : première apparition du patient (traitements courts)
-                df_pos = df[df[c_mont] > 0].dropna(subset=[c_date, c_pat]).copy()
-                df_pos[c_tarif] = df_pos[c_tarif].astype(str).str.strip()
-
-                df_7350 = df_pos[df_pos[c_tarif] == "7350"][[c_date, c_pat]].rename(columns={c_date: "_date", c_pat: "_pat"})
-                df_7350["_type"] = "7350"
-
-                df_physio = df_pos[df_pos[c_tarif].isin(["7301", "7311"])][[c_date, c_pat]].rename(columns={c_date: "_date", c_pat: "_pat"})
-                df_physio["_type"] = "physio"
-
-                df_25 = df_pos[df_pos[c_tarif] == "25.110"][[c_date, c_pat]].rename(columns={c_date: "_date", c_pat: "_pat"})
-                df_25["_type"] = "25.110"
-
-                df_f = pd.concat([df_7350, df_physio, df_25]).drop_duplicates(subset=["_date", "_pat", "_type"])
-                return df_f, ca_jour
-
-            df_f, ca_jour = parser(file1)
-            if file2 is not None:
-                df_f2, ca_jour2 = parser(file2)
-                df_f = pd.concat([df_f, df_f2]).drop_duplicates().reset_index(drop=True)
-                ca_jour = pd.concat([ca_jour, ca_jour2]).groupby(level=0).sum()
-                nb_fichiers = 2
-            else:
-                nb_fichiers = 1
-
-            # Jours ouvrés réels : jours où le CA total >= seuil_jour
-            jours_cabinet_flux = set(ca_jour[ca_jour >= seuil_jour].index)
-
-            df_f = df_f.sort_values("_date")
-            derniere_date = df_f["_date"].max()
-            premiere_date = df_f["_date"].min()
-
-            # Sous-ensembles par type
-            df_physio = df_f[df_f["_type"] == "physio"]
-            df_7350   = df_f[df_f["_type"] == "7350"]
-            df_25     = df_f[df_f["_type"] == "25.110"]
-
-            # --- 1. DÉCOUPAGE EN ÉPISODES DE TRAITEMENT ---
-            # Un épisode = séquence continue de séances 7301/7311 sans pause > PAUSE_TRAITEMENT jours.
-            # Le 7350 est refacturé tous les 36 séances ou 6 mois pour des raisons admin,
-            # il ne marque donc PAS le début d'un nouveau traitement.
-            PAUSE_TRAITEMENT = delai_fin  # paramètre utilisateur (défaut 60j)
-
-            episodes = []
-            for pat, grp in df_physio.groupby("_pat"):
-                seances = sorted(grp["_date"].tolist())
-                debut = seances[0]
-                precedente = seances[0]
-                count = 1
-                for s in seances[1:]:
-                    if (s - precedente).days > PAUSE_TRAITEMENT:
-                        episodes.append({"_pat": pat, "debut": debut, "fin": precedente, "nb_seances": count})
-                        debut = s
-                        count = 1
-                    else:
-                        count += 1
-                    precedente = s
-                episodes.append({"_pat": pat, "debut": debut, "fin": precedente, "nb_seances": count})
-
-            df_ep = pd.DataFrame(episodes)
-
-            # --- 2. RYTHME HEBDOMADAIRE (semaines actives par épisode) ---
-            # Pour chaque épisode, on compte les semaines distinctes avec au moins une séance.
-            rythmes_ep = []
-            for pat, grp in df_physio.groupby("_pat"):
-                seances = sorted(grp["_date"].tolist())
-                precedente = seances[0]
-                ep_seances = [seances[0]]
-                for s in seances[1:]:
-                    if (s - precedente).days > PAUSE_TRAITEMENT:
-                        if len(ep_seances) >= 2:
-                            semaines = pd.Series(ep_seances).dt.isocalendar().apply(
-                                lambda r: f"{r['year']}-{r['week']:02d}", axis=1
-                            ).nunique()
-                            if semaines >= 2:
-                                rythmes_ep.append(len(ep_seances) / semaines)
-                        ep_seances = [s]
-                    else:
-                        ep_seances.append(s)
-                    precedente = s
-                if len(ep_seances) >= 2:
-                    semaines = pd.Series(ep_seances).dt.isocalendar().apply(
-                        lambda r: f"{r['year']}-{r['week']:02d}", axis=1
-                    ).nunique()
-                    if semaines >= 2:
-                        rythmes_ep.append(len(ep_seances) / semaines)
-
-            rythme = pd.Series(rythmes_ep).mean() if rythmes_ep else 1.1
-
-            # --- 3. CHRONIQUES & MOYENNE SÉANCES/TRAITEMENT ---
-            seuil_termine = derniere_date - timedelta(days=delai_fin)
-            # Épisodes encore actifs (fin récente = en cours)
-            ep_en_cours = df_ep[df_ep["fin"] > seuil_termine]
-            ep_termines  = df_ep[df_ep["fin"] <= seuil_termine]
-
-            # Chroniques actifs = épisodes en cours satisfaisant au moins une condition :
-            #   1. Présents sur les 365 derniers jours (début <= derniere_date - 365j)
-            #   2. Episode avec >=45 séances
-            seuil_365_chron = derniere_date - timedelta(days=365)
-            chroniques_actifs = ep_en_cours[
-                (ep_en_cours["debut"] <= seuil_365_chron) |
-                (ep_en_cours["nb_seances"] >= 45)
-            ]
-            nb_chroniques = len(chroniques_actifs)
-
-            # Cadence hebdomadaire des chroniques (sur les 60 derniers jours de l'export)
-            # = nombre moyen de séances/semaine par chronique récemment
-            seuil_60 = derniere_date - timedelta(days=60)
-            jo_60_flux = jours_ouvres(seuil_60, derniere_date, jours_cabinet_flux)
-            semaines_90 = jo_60_flux / 5  # semaines ouvrées
-            seances_chroniques_90 = df_physio[
-                df_physio["_pat"].isin(chroniques_actifs["_pat"]) &
-                (df_physio["_date"] >= seuil_60)
-            ]
-            rdv_chron_sem = (len(seances_chroniques_90) / semaines_90) if semaines_90 > 0 else 0
-
-            # Moyenne séances/traitement = épisodes terminés NON chroniques
-            # + pour les chroniques on utilise une estimation haute (nb séances actuelles)
-            # car on ne connaît pas leur fin → on les note séparément
-            moy_seances = ep_termines['nb_seances'].mean() if not ep_termines.empty else df_ep['nb_seances'].mean()
-            nb_termines = len(ep_termines)
-
-            # p_stats conservé pour la compatibilité (filtre fantômes flux nouveaux)
-            p_stats = df_physio.groupby("_pat").agg(
-                date_min=("_date", 'min'),
-                date_max=("_date", 'max')
-            )
-
-            # --- 4. FLUX NOUVEAUX PATIENTS ---
-            # Logique par code :
-            # - 7350 : bilan premier traitement → nouveau si le patient n'a PAS de séance
-            #   7301/7311 dans les <delai_fin> jours AVANT la date du 7350
-            #   (évite de compter un patient qui reprend un 2e traitement comme nouveau)
-            # - 25.110 : première apparition du patient (traitements courts, pas de biais fantôme)
-            seuil_fantomes = premiere_date + timedelta(days=28)
-
-            # Index des séances physio par patient pour tester les antécédents
-            physio_dates = df_physio.groupby("_pat")["_date"].apply(list).to_dict()
-
-            def est_vraiment_nouveau(pat, date_bilan, delai):
-                # Nouveau si aucune séance 7301/7311 dans les <delai> jours précédant le bilan
-                if pat not in physio_dates:
-                    return True
-                seuil_avant = date_bilan - timedelta(days=delai)
-                return not any(seuil_avant <= d < date_bilan for d in physio_dates[pat])
-
-            # Garder un seul événement par patient pour 7350 (le premier bilan vraiment nouveau)
-            # Pas de drop_duplicates : un patient peut avoir plusieurs traitements distincts.
-            # est_vraiment_nouveau filtre déjà les 7350 d'un épisode en cours.
-            nouveaux_7350 = (
-                df_7350
-                .sort_values("_date")
-                .loc[lambda df: df.apply(lambda r: est_vraiment_nouveau(r["_pat"], r["_date"], delai_fin), axis=1)]
-            )
-
-            # 25.110 : première séance du patient par traitement distinct
-            # On garde la première apparition uniquement (pas de code bilan disponible)
-            nouveaux_25 = df_25.sort_values("_date").drop_duplicates(subset=["_pat"], keep="first")
-
-            def stats_periode(jours):
-                seuil = derniere_date - timedelta(days=jours)
-                jo = jours_ouvres(seuil, derniere_date, jours_cabinet_flux)
-                # 7350 dans la fenêtre, hors fantômes
-                n_7350 = nouveaux_7350[
-                    (nouveaux_7350["_date"] >= seuil) &
-                    (nouveaux_7350["_date"] > seuil_fantomes)
-                ]
-                # 25.110 : première séance dans la fenêtre
-                n_25 = nouveaux_25[nouveaux_25["_date"] >= seuil]
-                count = len(n_7350) + len(n_25)
-                return count, count / jo if jo > 0 else 0
-
-            return {
-                "moy_seances": moy_seances,
-                "nb_termines": nb_termines,
-                "rythme_reel": rythme,
-                "flux_30":  stats_periode(30),
-                "flux_60":  stats_periode(60),
-                "flux_120": stats_periode(120),
-                "flux_365": stats_periode(365),
-                "derniere_date": derniere_date,
-                "premiere_date": premiere_date,
-                "nb_fichiers": nb_fichiers,
-                "delai_fin": delai_fin,
-                "nb_chroniques": nb_chroniques,
-                "rdv_chron_sem": rdv_chron_sem,
-            }
-
-        data = get_full_analysis(uploaded_file, uploaded_file2, delai_fin_traitement, seuil_jour_flux)
+        hist = historique_prestations(sources)
+        if fichiers:
+            afficher_lectures()
+            afficher_memoire_exports()
+        nb_en_lecture = sum(cle in st.session_state.lectures for cle, _ in sources)
+        if nb_en_lecture:
+            st.info(f"⏳ Lecture de **{nb_en_lecture} fichier(s)** en cours — l'analyse démarrera automatiquement.")
+            return
+        if not hist["exports"]:
+            return
+        # L'export le plus récent devient celui repris par les autres pages
+        cle_recente = max(hist["exports"], key=lambda c: hist["fin"][c])
+        if cle_recente in st.session_state.exports:
+            st.session_state.export_actif = cle_recente
+
+        data = get_full_analysis(hist["prestations"], tuple(hist["exports"]), delai_fin_traitement, seuil_jour_flux)
 
         # --- INFOS EXPORT ---
         periode = f"{data['premiere_date'].strftime('%d.%m.%Y')} → {data['derniere_date'].strftime('%d.%m.%Y')}"
         nb_mois = round((data['derniere_date'] - data['premiere_date']).days / 30.5)
-        if data['nb_fichiers'] == 2:
-            st.success(f"✅ **2 fichiers fusionnés** — Historique de **{nb_mois} mois** ({periode})")
+        if data['nb_fichiers'] > 1:
+            st.success(f"✅ **{data['nb_fichiers']} fichiers fusionnés** — Historique de **{nb_mois} mois** ({periode})"
+                       f" — {hist['doublons']:,} lignes communes à plusieurs exports comptées une seule fois".replace(",", "'"))
         else:
             st.info(f"📄 **1 fichier** — Historique de **{nb_mois} mois** ({periode})")
 
-        st.caption(f"Moyenne séances/traitement : **{data['moy_seances']:.1f}** séances (sur {data['nb_termines']} épisodes terminés, pause > {data['delai_fin']}j) | {data['nb_chroniques']} patients chroniques actifs (≥52 séances sans interruption) — leurs places sont déduites de la capacité disponible")
+        st.caption(f"Moyenne séances/traitement : **{data['moy_seances']:.1f}** séances (sur {data['nb_termines']} épisodes terminés, pause > {data['delai_fin']}j) | {data['nb_chroniques']} patients chroniques actifs (≥{SEANCES_CHRONIQUE} séances ou ≥{JOURS_CHRONIQUE} jours de traitement sans interruption) — leurs places sont déduites de la capacité disponible")
 
         # --- AFFICHAGE FLUX ---
         st.subheader(f"📈 Recrutement Réel (Calculé au {data['derniere_date'].strftime('%d/%m/%Y')})")
@@ -577,6 +1656,73 @@ def render_stats_patients():
         c_r3.metric("Derniers 120j", f"{data['flux_120'][0]} pat.", f"{data['flux_120'][1]:.2f} / j ouvré")
         c_r4.metric("Derniers 365j", f"{data['flux_365'][0]} pat.", f"{data['flux_365'][1]:.2f} / j ouvré")
 
+        fenetre_courbe = st.radio("Fenêtre glissante :", [30, 60, 120, 365], index=1, horizontal=True,
+                                  format_func=lambda j: f"{j} jours", key="fenetre_recrutement")
+        courbe = courbe_recrutement(data["recrutement"], fenetre_courbe)
+        if courbe.empty:
+            st.caption("Historique trop court pour la courbe de recrutement sur cette fenêtre.")
+        else:
+            st.line_chart(courbe)
+
+        # --- CHARGE PAR THÉRAPEUTE ---
+        charge = flux_charge_therapeutes(hist["prestations"], tuple(hist["exports"]), delai_fin_traitement)
+        if charge.empty:
+            st.caption("🧑‍⚕️ Charge par thérapeute indisponible : colonne Thérapeute absente ou vide dans les prestations.")
+        else:
+            st.subheader("🧑‍⚕️ Charge hebdomadaire par thérapeute")
+            mesures_charge = {"Séances": "seances", "Patients distincts": "patients", "Part chroniques": "part_chroniques"}
+            mesure = st.radio("Mesure :", list(mesures_charge), horizontal=True, key="charge_mesure")
+            grille_charge = charge.pivot(index="therapeute", columns="semaine", values=mesures_charge[mesure])
+            grille_charge = grille_charge.loc[charge.groupby("therapeute")["seances"].sum().sort_values(ascending=False).index]
+            fig_charge = px.imshow(
+                grille_charge, aspect="auto", color_continuous_scale="Blues",
+                labels={"x": "Semaine", "y": "Thérapeute", "color": mesure},
+            )
+            # Défilement : 52 dernières semaines affichées, le reste de l'historique via le curseur
+            fig_charge.update_xaxes(range=[data['derniere_date'] - timedelta(weeks=52), data['derniere_date']], rangeslider_visible=True)
+            fig_charge.update_layout(height=max(300, 28 * len(grille_charge) + 160))
+            st.plotly_chart(fig_charge, use_container_width=True)
+
+            if st.button("📏 Pré-remplir la simulation avec la charge mesurée (52 dernières semaines)", key="btn_capa_mesuree"):
+                capa_actuelle = st.session_state.get("capa_df")
+                cabinets = dict(zip(capa_actuelle["Thérapeute"], capa_actuelle["Cabinet"])) if capa_actuelle is not None else {}
+                st.session_state.capa_df = capacite_mesuree(charge, data['derniere_date'], cabinets)
+                st.caption("Places/Sem = 90e centile des séances par semaine travaillée, Semaines/an = semaines travaillées. "
+                           "Vérifiez le cabinet de chaque thérapeute avant de calculer.")
+
+        # --- COHORTES MENSUELLES ---
+        # Matrices gardées en session (par délai de fin) et complétées mois par mois : à l'ajout d'un export,
+        # seuls les mois touchés sont recalculés ; sans changement d'historique, rien n'est relu
+        cles_hist = tuple(hist["exports"])
+        memo_cohortes = st.session_state.setdefault("cohortes", {}).setdefault(
+            delai_fin_traitement, {"exports": None, "mois": {}, "resultat": None})
+        if memo_cohortes["exports"] != cles_hist:
+            def seances_physio():
+                df_f = flux_evenements(hist["prestations"], cles_hist)
+                return df_f[df_f["_type"] == "physio"]
+            memo_cohortes["resultat"] = cohortes_mensuelles(
+                flux_episodes(hist["prestations"], cles_hist, delai_fin_traitement)["episodes"], seances_physio,
+                data['premiere_date'], data['derniere_date'], delai_fin_traitement, memo_cohortes["mois"])
+            memo_cohortes["exports"] = cles_hist
+        maintien, seances_sem, patients_cohorte = memo_cohortes["resultat"]
+        if not maintien.empty:
+            st.subheader("🧬 Cohortes mensuelles de nouveaux traitements")
+            st.caption(f"Une ligne par mois de début de traitement ({patients_cohorte.sum()} traitements, hors fantômes du début d'historique). "
+                       "Colonnes : semaines depuis la première séance ; cases vides = pas encore observables.")
+            t_maintien, t_seances = st.tabs(["🟢 Part encore en traitement", "🗓️ Séances / patient / semaine"])
+            with t_maintien:
+                fig_maintien = px.imshow(maintien * 100, aspect="auto", color_continuous_scale="Greens", zmin=0, zmax=100,
+                                         labels={"x": "Semaines depuis le début", "y": "Cohorte", "color": "% en traitement"})
+                st.plotly_chart(fig_maintien, use_container_width=True)
+                # Courbe moyenne pondérée par la taille des cohortes (cohortes observées à chaque semaine)
+                poids = maintien.notna().mul(patients_cohorte, axis=0)
+                courbe_maintien = (maintien.fillna(0).mul(patients_cohorte, axis=0).sum() / poids.sum().replace(0, np.nan) * 100)
+                st.line_chart(courbe_maintien.rename("% encore en traitement (moyenne des cohortes)"))
+            with t_seances:
+                fig_seances = px.imshow(seances_sem, aspect="auto", color_continuous_scale="Blues",
+                                        labels={"x": "Semaines depuis le début", "y": "Cohorte", "color": "Séances / patient"})
+                st.plotly_chart(fig_seances, use_container_width=True)
+
         # --- FORMULAIRE CONFIGURATION ---
         with st.form("form_v11_1"):
             st.subheader("⚙️ Simulation des besoins (Cabinets A & B)")
@@ -594,6 +1740,7 @@ def render_stats_patients():
                     cols_ok = {"Thérapeute", "Cabinet", "Places/Sem", "Semaines/an"}
                     if cols_ok.issubset(set(df_loaded.columns)):
                         st.session_state.capa_df = df_loaded[list(cols_ok)].copy()
+                        ecrire_config_base("config_therapeutes", st.session_state.capa_df)
                         st.success("✅ Configuration chargée.")
                     else:
                         st.warning("⚠️ Colonnes attendues : Thérapeute, Cabinet, Places/Sem, Semaines/an.")
@@ -601,6 +1748,8 @@ def render_stats_patients():
                     st.error(f"Erreur : {e}")
 
             if 'capa_df' not in st.session_state:
+                st.session_state.capa_df = lire_config_base("config_therapeutes")
+            if st.session_state.capa_df is None:
                 st.session_state.capa_df = pd.DataFrame([
                     {"Thérapeute": f"Thérapeute {i}", "Cabinet": "A" if i <= 6 else "B",
                      "Places/Sem": 0, "Semaines/an": 43} for i in range(1, 13)
@@ -635,8 +1784,30 @@ def render_stats_patients():
                 help="Téléchargez ce fichier pour le recharger la prochaine fois sans tout ressaisir."
             )
 
+        # Le calcul (scénario choisi + grille complète) n'est refait qu'au clic : la simulation est gardée
+        # en session pour parcourir la carte de chaleur sans recalcul, tant que l'historique analysé est le même.
+        cle_simulation = (tuple(hist["exports"]), delai_fin_traitement, seuil_jour_flux)
         if btn_go:
             st.session_state.capa_df = edited_df
+            ecrire_config_base("config_therapeutes", edited_df)
+            axes_grille = {
+                "occupation": np.arange(50, 101, 5),
+                "rythme": np.round(np.arange(0.5, 3.01, 0.1), 1),
+                "seances": np.arange(max(1, round(in_seances * 0.5)), round(in_seances * 1.5) + 1),
+                "jours": np.arange(1, 7),
+            }
+            st.session_state.simulation = {
+                "cle": cle_simulation,
+                "capa_df": edited_df,
+                "parametres": (in_seances, in_rythme, in_occup, in_jours),
+                "axes": axes_grille,
+                "grille": grille_scenarios(edited_df, data['rdv_chron_sem'], axes_grille),
+            }
+
+        simulation = st.session_state.get("simulation")
+        if simulation is not None and simulation["cle"] == cle_simulation:
+            edited_df = simulation["capa_df"]
+            in_seances, in_rythme, in_occup, in_jours = simulation["parametres"]
 
             def calc_capa(df_p):
                 annuel = (df_p['Places/Sem'] * df_p['Semaines/an']).sum()
@@ -695,6 +1866,43 @@ def render_stats_patients():
                 col1.metric("Capacité totale B", f"{c_b:.1f} RDV/sem")
                 col2.metric("Capacité disponible B", f"{cd_b:.1f} RDV/sem")
 
+            # --- CARTE DE CHALEUR DES SCÉNARIOS ---
+            st.markdown("#### 🗺️ Grille de scénarios")
+            st.caption(f"Écart entre le recrutement réel des 60 derniers jours ({data['flux_60'][1]:.2f} / j ouvré) "
+                       "et le besoin théorique de chaque scénario : vert = recrutement suffisant, rouge = insuffisant.")
+            axes_grille = simulation["axes"]
+            noms_axes = list(AXES_SCENARIOS)
+            col_g1, col_g2, col_g3 = st.columns(3)
+            cab_grille = col_g1.radio("Périmètre :", ["TOTAL", "A", "B"], horizontal=True, key="grille_cabinet")
+            axe_x = col_g2.selectbox("Axe horizontal :", noms_axes, index=0, format_func=AXES_SCENARIOS.get, key="grille_axe_x")
+            axe_y = col_g3.selectbox("Axe vertical :", [a for a in noms_axes if a != axe_x], index=0, format_func=AXES_SCENARIOS.get, key="grille_axe_y")
+
+            # Les deux autres axes sont fixés (par défaut au point le plus proche du scénario calculé)
+            valeurs_form = dict(zip(["seances", "rythme", "occupation", "jours"], simulation["parametres"]))
+            selection = {}
+            axes_fixes = [a for a in noms_axes if a not in (axe_x, axe_y)]
+            for col_fixe, axe in zip(st.columns(len(axes_fixes)), axes_fixes):
+                valeurs = axes_grille[axe].tolist()
+                defaut = valeurs[int(np.abs(axes_grille[axe] - valeurs_form[axe]).argmin())]
+                with col_fixe:
+                    selection[axe] = valeurs.index(st.select_slider(AXES_SCENARIOS[axe], options=valeurs, value=defaut, key=f"grille_fixe_{axe}_{simulation['parametres']}"))
+
+            coupe = simulation["grille"][cab_grille][tuple(selection.get(a, slice(None)) for a in noms_axes)]
+            if noms_axes.index(axe_x) < noms_axes.index(axe_y):
+                coupe = coupe.T  # lignes = axe vertical
+            fig_grille = px.imshow(
+                data['flux_60'][1] - coupe,
+                x=[str(v) for v in axes_grille[axe_x]], y=[str(v) for v in axes_grille[axe_y]],
+                color_continuous_scale="RdYlGn", color_continuous_midpoint=0, aspect="auto", origin="lower",
+                labels={"x": AXES_SCENARIOS[axe_x], "y": AXES_SCENARIOS[axe_y], "color": "Réel 60j − besoin"},
+            )
+            fig_grille.update_traces(
+                customdata=coupe,
+                hovertemplate=f"{AXES_SCENARIOS[axe_x]} : %{{x}}<br>{AXES_SCENARIOS[axe_y]} : %{{y}}"
+                              "<br>Besoin : %{customdata:.2f} / jour<br>Écart : %{z:+.2f}<extra></extra>",
+            )
+            st.plotly_chart(fig_grille, use_container_width=True)
+
     except Exception as e:
         st.error(f"❌ Erreur : {e}")
 
@@ -705,7 +1913,17 @@ if 'page' not in st.session_state:
 if 'analyse_lancee' not in st.session_state:
     st.session_state.analyse_lancee = False
 if 'config_medecins' not in st.session_state:
-    st.session_state.config_medecins = {}
+    cfg_base = lire_config_base("config_medecins")
+    st.session_state.config_medecins = dict(zip(cfg_base["variante"], cfg_base["canonique"])) if cfg_base is not None else {}
+if 'groupes_assureurs' not in st.session_state:
+    cfg_base = lire_config_base("groupes_assureurs")
+    st.session_state.groupes_assureurs = dict(zip(cfg_base["assureur"], cfg_base["groupe"])) if cfg_base is not None else dict(GROUPES_ASSUREURS_DEFAUT)
+if 'exports' not in st.session_state:
+    st.session_state.exports = {}
+if 'lectures' not in st.session_state:
+    st.session_state.lectures = {}
+if 'echecs_lecture' not in st.session_state:
+    st.session_state.echecs_lecture = {}
 
 # ==========================================
 # 🏠 PAGE D'ACCUEIL (STRUCTURÉE PAR SOURCE DE DONNÉES)
@@ -837,27 +2055,50 @@ elif st.session_state.page == "factures":
     </div>''', unsafe_allow_html=True)
     st.title("📊 Analyse de la Facturation")
     uploaded_file = st.sidebar.file_uploader("Charger le fichier Excel (.xlsx)", type="xlsx", key="fact_file")
+    ds = export_courant(uploaded_file, {"factures": {"colonnes": ["date_facture", "loi", "assureur", "fournisseur", "statut", "montant", "date_paiement"]}})
 
-    if uploaded_file:
+    if ds is not None:
         try:
-            @st.cache_data
-            def lire_factures(f): return pd.read_excel(f, header=0)
-            df_brut = lire_factures(uploaded_file)
-            valider_colonnes(df_brut, 16, "Factures")
+            df_brut = onglet_export(ds, "factures")
             st.sidebar.header("🔍 2. Filtres")
-            _c_tmp = resoudre_colonnes(df_brut)
-            if _c_tmp["fournisseur"] is None:
-                df_brut["Fournisseur de prestation"] = "Cabinet"
-                _c_tmp["fournisseur"] = "Fournisseur de prestation"
-            fournisseurs = df_brut[_c_tmp["fournisseur"]].dropna().unique().tolist()
+            fournisseurs = df_brut["fournisseur"].dropna().unique().tolist()
             sel_fournisseurs = st.sidebar.multiselect("Fournisseurs :", options=sorted(fournisseurs), default=fournisseurs)
-            lois = df_brut[_c_tmp["loi"]].dropna().unique().tolist()
+            lois = df_brut["loi"].dropna().unique().tolist()
             sel_lois = st.sidebar.multiselect("Types de Loi :", options=sorted(lois), default=lois)
             st.sidebar.header("📊 3. Options Délais")
             show_med = st.sidebar.checkbox("Afficher la Médiane", value=True)
             show_std = st.sidebar.checkbox("Afficher l'Écart-type", value=True)
             regrouper_assureurs = st.sidebar.checkbox("Regrouper par groupe d'assureurs", value=False,
                 help="Fusionne les assureurs appartenant au même groupe (ex. Le Groupe Mutuel + Philos → Groupe Mutuel)")
+            if regrouper_assureurs:
+                groupes_file = st.sidebar.file_uploader("Charger groupes_assureurs.xlsx", type="xlsx", key="groupes_assureurs_up",
+                    help="Fichier avec col A = nom du groupe, col B/C/D… = assureurs (noms Ephysio) à fusionner.")
+                if groupes_file is not None:
+                    try:
+                        df_grp = pd.read_excel(groupes_file, dtype=str)
+                        mapping_grp = {}
+                        for _, row in df_grp.iterrows():
+                            groupe = str(row.iloc[0]).strip() if pd.notna(row.iloc[0]) else None
+                            if not groupe or groupe == 'nan': continue
+                            for val in row.iloc[1:]:
+                                v = str(val).strip() if pd.notna(val) else None
+                                if v and v != 'nan':
+                                    mapping_grp[v] = groupe
+                        st.session_state.groupes_assureurs = mapping_grp
+                        ecrire_config_base("groupes_assureurs", pd.DataFrame({"assureur": list(mapping_grp), "groupe": list(mapping_grp.values())}))
+                        st.sidebar.success(f"✅ {df_grp.iloc[:, 0].nunique()} groupes, {len(mapping_grp)} assureurs")
+                    except Exception as e:
+                        st.sidebar.error(f"Erreur : {e}")
+                # Table courante au même format (un groupe par ligne), pour la compléter puis la recharger
+                membres = pd.Series(list(st.session_state.groupes_assureurs), index=list(st.session_state.groupes_assureurs.values()))
+                par_groupe = membres.groupby(level=0, sort=True).agg(list)
+                df_export_grp = pd.DataFrame(par_groupe.tolist(), index=par_groupe.index)
+                df_export_grp.columns = [f"Assureur {i + 1}" for i in range(df_export_grp.shape[1])]
+                buf_grp = io.BytesIO()
+                df_export_grp.rename_axis("Groupe").reset_index().to_excel(buf_grp, index=False, engine='openpyxl')
+                buf_grp.seek(0)
+                st.sidebar.download_button("📥 Exporter les groupes (.xlsx)", data=buf_grp, file_name="groupes_assureurs.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
             st.sidebar.header("📅 4. Périodes & Simulation")
             options_p = {"Global": None, "6 mois": 6, "4 mois": 4, "3 mois": 3, "2 mois": 2, "1 mois": 1}
             periods_sel = st.sidebar.multiselect("Analyser les périodes :", list(options_p.keys()), default=["Global", "4 mois", "2 mois"])
@@ -867,100 +2108,109 @@ elif st.session_state.page == "factures":
                 st.session_state.analyse_lancee = True
             btn_simuler = col_b2.button("🔮 Simuler", use_container_width=True)
 
-            _c = resoudre_colonnes(df_brut)
-            # Fournisseur absent en mono-thérapeute → colonne virtuelle
-            if _c["fournisseur"] is None:
-                df_brut["Fournisseur de prestation"] = "Cabinet"
-                _c["fournisseur"] = "Fournisseur de prestation"
-
-            df = df_brut[
-                (df_brut[_c["fournisseur"]].isin(sel_fournisseurs)) &
-                (df_brut[_c["loi"]].isin(sel_lois))
-            ].copy()
-            df = df.rename(columns={
-                _c["date_facture"]: "date_facture", _c["loi"]: "loi",
-                _c["assureur"]: "assureur", _c["fournisseur"]: "fournisseur",
-                _c["statut"]: "statut", _c["montant"]: "montant",
-                _c["date_paiement"]: "date_paiement"
-            })
-            
-            df["date_facture"] = df["date_facture"].apply(convertir_date)
-            df["date_paiement"] = df["date_paiement"].apply(convertir_date)
-            df = df[df["date_facture"].notna()].copy()
-            df["montant"] = pd.to_numeric(df["montant"], errors="coerce").fillna(0)
-            df["statut"] = df["statut"].astype(str).str.lower().str.strip()
-            df["assureur"] = df["assureur"].fillna("Patient")
-            # LCA : remboursement direct par le patient → assureur = "Patient"
-            df.loc[df["loi"] == "LCA", "assureur"] = "Patient"
-
-            # --- GROUPES D'ASSUREURS SUISSES ---
-            # Mapping : nom exact dans Ephysio → nom du groupe affiché
-            # LCA et LAI exclues du regroupement
-            GROUPES_NOM = {
-                # LAMal — Groupe Mutuel
-                "Philos, caisse maladie":            "Groupe Mutuel, caisse maladie",
-                "Caisse maladie Avenir":              "Groupe Mutuel, caisse maladie",
-                "Easy Sana caisse maladie":           "Groupe Mutuel, caisse maladie",
-                "SUPRA-1846 SA":                      "Groupe Mutuel, caisse maladie",
-                # LAMal — CSS
-                "Arcosana":                           "CSS Assurances",
-                "Intras, caisse maladie":              "CSS Assurances",
-                # LAMal — Helsana
-                "Progrès (incl. Sansan)":              "Helsana Assurances",
-                # LAMal — Visana
-                "sana24":                              "Visana Services AG",
-                "vivacare":                            "Visana Services AG",
-                "GALENOS":                             "Visana Services AG",
-                # LAA — Groupe Mutuel
-                "Caisse maladie Avenir (accident)":    "Groupe Mutuel, caisse maladie (accident)",
-            }
-            LOI_EXCLUES_REGROUPEMENT = {"LCA", "LAI"}
-
+            # Factures nettoyées, triées par date et délai calculé une seule fois par jeu de filtres ;
+            # chaque période n'est plus qu'une tranche trouvée par recherche dichotomique
+            ajd = pd.Timestamp(datetime.today().date())
+            cle_filtres = (ds.get("cle") or st.session_state.get("export_actif"), tuple(sorted(map(str, sel_fournisseurs))),
+                           tuple(sorted(map(str, sel_lois))),
+                           tuple(sorted(st.session_state.groupes_assureurs.items())) if regrouper_assureurs else None, ajd)
+            donnees = st.session_state.get("factures_donnees")
+            if donnees is None or donnees["cle"] != cle_filtres:
+                # Colonnes déjà résolues et dates déjà converties à l'ingestion
+                df = df_brut.loc[
+                    (df_brut["fournisseur"].isin(sel_fournisseurs)) &
+                    (df_brut["loi"].isin(sel_lois)) &
+                    (df_brut["date_facture"].notna()),
+                    ["date_facture", "loi", "assureur", "fournisseur", "statut", "montant", "date_paiement"]
+                ].copy()
+                df["montant"] = pd.to_numeric(df["montant"], errors="coerce").fillna(0)
+                df["statut"] = remapper_categories(df["statut"], lambda s: str(s).lower().strip())
+                df["assureur"] = completer_categories(df["assureur"], ["Patient"]).fillna("Patient")
+                # LCA : remboursement direct par le patient → assureur = "Patient"
+                df.loc[df["loi"] == "LCA", "assureur"] = "Patient"
+
+                if regrouper_assureurs:
+                    df["assureur"] = appliquer_groupes_assureurs(df["assureur"], df["loi"], st.session_state.groupes_assureurs)
+
+                df = df.sort_values("date_facture", kind="stable").reset_index(drop=True)
+                df["delai"] = (df["date_paiement"] - df["date_facture"]).dt.days
+                f_att = df[df["statut"].str.startswith("en attente", na=False) & (df["statut"] != "en attente (annulé)")].copy()
+                f_att["delai_actuel"] = (ajd - f_att["date_facture"]).dt.days
+                donnees = {"cle": cle_filtres, "ajd": ajd, "df": df, "payees": df[df["date_paiement"].notna()],
+                           "f_att": f_att, "agregats": {}}
+                st.session_state.factures_donnees = donnees
+            df, f_att = donnees["df"], donnees["f_att"]
             if regrouper_assureurs:
-                def appliquer_groupe(row):
-                    if row["loi"] in LOI_EXCLUES_REGROUPEMENT:
-                        return row["assureur"]
-                    return GROUPES_NOM.get(str(row["assureur"]).strip(), str(row["assureur"]).strip())
-                df["assureur"] = df.apply(appliquer_groupe, axis=1)
                 st.sidebar.caption("✅ Regroupement actif — LCA et LAI non fusionnées.")
-
-            ajd = pd.Timestamp(datetime.today().date())
-            f_att = df[df["statut"].str.startswith("en attente") & (df["statut"] != "en attente (annulé)")].copy()
-            f_att["delai_actuel"] = (ajd - f_att["date_facture"]).dt.days
             st.metric("💰 TOTAL BRUT EN ATTENTE", f"{chf(f_att['montant'].sum())} CHF")
 
+            # Modèle de survie des paiements : une fois par période et par jeu de filtres, partagé
+            # par la simulation et les onglets
+            historiques_p = {}
+            for p_nom in periods_sel:
+                df_p, p_hist = tranches_periode(donnees, options_p[p_nom])
+                modele_p = agregat_periode(donnees, options_p[p_nom], "survie", lambda d, h: survie_paiements(d, ajd))
+                historiques_p[p_nom] = (df_p, p_hist, modele_p)
+
+            # Courbe d'encaissement attendu par période, gardée avec le modèle (par période et horizon) :
+            # horizons et date cible y sont lus
+            jours_delta = (pd.Timestamp(date_cible) - ajd).days if btn_simuler else 0
+            horizon_courbe = max(HORIZON_ENCAISSEMENT, jours_delta)
+            courbes_p = {p_nom: agregat_periode(donnees, options_p[p_nom], ("courbe", horizon_courbe),
+                                                lambda d, h, m=historiques_p[p_nom][2]: courbe_encaissements(f_att, m, horizon_courbe))
+                         for p_nom in periods_sel}
+
             if btn_simuler:
-                jours_delta = (pd.Timestamp(date_cible) - ajd).days
                 if jours_delta >= 0:
-                    res_sim = []
+                    # Fins de semaine jusqu'à la date cible, date cible comprise
+                    jours_sim = sorted(set(range(7, jours_delta, 7)) | {jours_delta})
+                    res_sim, semaines_sim = [], {}
                     for p_nom in periods_sel:
-                        val = options_p[p_nom]
-                        limit = ajd - pd.DateOffset(months=val) if val else df["date_facture"].min()
-                        p_hist_sim = df[(df["date_paiement"].notna()) & (df["date_facture"] >= limit)].copy()
-                        p_hist_sim["delai"] = (p_hist_sim["date_paiement"] - p_hist_sim["date_facture"]).dt.days
-                        liq, t = calculer_liquidites_fournisseur(f_att, p_hist_sim, [jours_delta])
-                        res_sim.append({"Période": p_nom, "Estimation (CHF)": f"{chf_int(round(liq[jours_delta]))}", "Probabilité": f"{t[jours_delta]:.1%}"})
+                        taux = taux_paiement_global(historiques_p[p_nom][2], [jours_delta])[0]
+                        quantiles = np.percentile(simuler_encaissements(f_att, historiques_p[p_nom][2], jours_sim), [10, 50, 90], axis=0)
+                        res_sim.append({"Période": p_nom, "Estimation (CHF)": f"{chf_int(round(courbes_p[p_nom][jours_delta]))}",
+                                        "P10 (CHF)": chf_int(round(quantiles[0, -1])), "P50 (CHF)": chf_int(round(quantiles[1, -1])),
+                                        "P90 (CHF)": chf_int(round(quantiles[2, -1])), "Probabilité": f"{taux:.1%}"})
+                        semaines_sim[p_nom] = pd.DataFrame(quantiles.T, columns=["P10", "P50", "P90"],
+                                                           index=pd.DatetimeIndex([ajd + pd.Timedelta(days=j) for j in jours_sim], name="Encaissé d'ici le"))
                     st.table(pd.DataFrame(res_sim))
+                    st.caption(f"P10 / P50 / P90 : {NB_SCENARIOS:,} scénarios de Monte Carlo".replace(",", "'") +
+                               " — délai de chaque facture en attente tiré dans la distribution observée de son assureur, sachant son âge actuel.")
+                    if len(jours_sim) > 1:
+                        for p_nom, semaines in semaines_sim.items():
+                            with st.expander(f"📅 Encaissements cumulés par semaine — {p_nom}"):
+                                st.line_chart(semaines)
+                                st.dataframe(semaines.map(lambda v: f"{chf_int(round(v))}").set_axis(semaines.index.strftime("%d.%m.%Y")),
+                                             use_container_width=True)
 
             if st.session_state.analyse_lancee:
                 tab1, tab2, tab3, tab4 = st.tabs(["💰 Liquidités", "🕒 Délais", "⚠️ Retards", "📈 Évolution"])
                 for p_name in periods_sel:
-                    val = options_p[p_name]
-                    limit_p = ajd - pd.DateOffset(months=val) if val else df["date_facture"].min()
-                    df_p = df[df["date_facture"] >= limit_p]
-                    p_hist = df_p[df_p["date_paiement"].notna()].copy()
-                    p_hist["delai"] = (p_hist["date_paiement"] - p_hist["date_facture"]).dt.days
+                    df_p, p_hist, modele_p = historiques_p[p_name]
                     with tab1:
                         st.subheader(f"Liquidités : {p_name}")
                         horizons = [10, 20, 30]
-                        liq, t = calculer_liquidites_fournisseur(f_att, p_hist, horizons)
-                        st.table(pd.DataFrame({"Horizon": [f"Sous {h}j" for h in horizons], "Estimation (CHF)": [f"{chf_int(round(liq[h]))}" for h in horizons], "Probabilité": [f"{round(t[h]*100)}%" for h in horizons]}))
+                        courbe = courbes_p[p_name]
+                        t = taux_paiement_global(modele_p, horizons)
+                        st.table(pd.DataFrame({"Horizon": [f"Sous {h}j" for h in horizons], "Estimation (CHF)": [f"{chf_int(round(courbe[h]))}" for h in horizons], "Probabilité": [f"{round(x*100)}%" for x in t]}))
+                        encaissements = pd.DataFrame({
+                            "Cumulé (CHF)": courbe[:HORIZON_ENCAISSEMENT + 1],
+                            "Par jour (CHF)": np.diff(courbe[:HORIZON_ENCAISSEMENT + 1], prepend=0.0),
+                        }, index=pd.Index(range(HORIZON_ENCAISSEMENT + 1), name="Jours"))
+                        mesure_enc = st.radio("Courbe d'encaissement :", list(encaissements.columns), horizontal=True, key=f"encaissement_{p_name}")
+                        st.line_chart(encaissements[mesure_enc])
+                        st.caption("Estimation de survie (Kaplan–Meier) : les factures encore en attente de la période sont prises en compte comme non payées à ce jour. "
+                                   "Les montants dépendent de l'âge actuel de chaque facture en attente : une facture impayée depuis a jours "
+                                   "compte pour 1 − S(a+j)/S(a) d'ici j jours (S : part des factures encore impayées après t jours, "
+                                   "par assureur et fournisseur). Une facture déjà ancienne pèse donc moins qu'une facture récente, "
+                                   "et l'estimation évolue d'un jour à l'autre à mesure que les factures vieillissent. "
+                                   "La colonne Probabilité reste la part des factures de la période payées sous chaque délai, sans condition d'âge.")
                     with tab2:
                         st.subheader(f"Délais par assureur ({p_name})")
                         if not p_hist.empty:
-                            stats = p_hist.groupby("assureur")["delai"].agg(
+                            stats = agregat_periode(donnees, options_p[p_name], "delais", lambda d, h: h.groupby("assureur", observed=True)["delai"].agg(
                                 mean='mean', median='median', std='std', count='count'
-                            ).reset_index()
+                            ).reset_index()).copy()
                             stats.columns = ["Assureur", "Moyenne (j)", "Médiane (j)", "Écart-type (j)", "Nb factures"]
                             # Arrondir à 2 décimales
                             stats["Moyenne (j)"]    = stats["Moyenne (j)"].round(2)
@@ -992,14 +2242,15 @@ elif st.session_state.page == "factures":
                             st.download_button("📄 Télécharger en PDF", _pdf_buf, file_name=f"delais_{p_name}.pdf", mime="application/pdf", key=f"pdf_delais_{p_name}", use_container_width=True)
                     with tab3:
                         st.subheader(f"Analyse des retards > 30j ({p_name})")
-                        df_att_30 = f_att[f_att["delai_actuel"] > 30].copy()
-                        df_pay_30 = p_hist[p_hist["delai"] > 30].copy()
-                        plus_30 = pd.concat([df_pay_30, df_att_30])
-                        total_vol = df_p.groupby("assureur").size().reset_index(name="Volume Total")
-                        ret_assur = plus_30.groupby("assureur").size().reset_index(name="Nb Retards")
-                        merged = pd.merge(ret_assur, total_vol, on="assureur", how="right").fillna(0)
-                        merged["Nb Retards"] = merged["Nb Retards"].astype(int)
-                        merged["% Retard"] = (merged["Nb Retards"] / merged["Volume Total"] * 100).round(1)
+                        def retards_periode(d, h):
+                            plus_30 = pd.concat([h.loc[h["delai"] > 30, ["assureur"]], f_att.loc[f_att["delai_actuel"] > 30, ["assureur"]]])
+                            total_vol = d.groupby("assureur", observed=True).size().reset_index(name="Volume Total")
+                            ret_assur = plus_30.groupby("assureur", observed=True).size().reset_index(name="Nb Retards")
+                            merged = pd.merge(ret_assur, total_vol, on="assureur", how="right").fillna({"Nb Retards": 0})
+                            merged["Nb Retards"] = merged["Nb Retards"].astype(int)
+                            merged["% Retard"] = (merged["Nb Retards"] / merged["Volume Total"] * 100).round(1)
+                            return merged
+                        merged = agregat_periode(donnees, options_p[p_name], "retards", retards_periode)
                         st.metric(f"Total Retards ({p_name})", f"{int(merged['Nb Retards'].sum())} factures")
                         st.dataframe(merged[["assureur", "Nb Retards", "Volume Total", "% Retard"]].sort_values("% Retard", ascending=False), use_container_width=True)
                         _pdf_buf = generer_pdf_tableau(f"Retards > 30j — {p_name}", merged[["assureur", "Nb Retards", "Volume Total", "% Retard"]].sort_values("% Retard", ascending=False), f"Période : {p_name}")
@@ -1007,37 +2258,27 @@ elif st.session_state.page == "factures":
                 
                 with tab4:
                     st.subheader("📈 Évolution du délai de remboursement")
-                    ordre_chrono = ["Global", "6 mois", "4 mois", "3 mois", "2 mois"]
-                    periodes_graph = {"Global": None, "6 mois": 6, "4 mois": 4, "3 mois": 3, "2 mois": 2}
-                    evol_data = []
-                    p_hist_global = df[df["date_paiement"].notna()].copy()
-                    p_hist_global["delai"] = (p_hist_global["date_paiement"] - p_hist_global["date_facture"]).dt.days
                     # Classement global par volume de factures (base pour les tops)
-                    ranking_assureurs = p_hist_global.groupby("assureur").size().sort_values(ascending=False)
+                    ranking_assureurs = agregat_periode(donnees, None, "volumes",
+                        lambda d, h: h.groupby("assureur", observed=True).size().sort_values(ascending=False))
                     tous_assureurs = ranking_assureurs.index.tolist()
+                    # Série mensuelle par assureur : un regroupement sur tout l'historique, gardé pour ce jeu de filtres
+                    serie_delais = agregat_periode(donnees, None, "delais_mensuels", lambda d, h: delais_mensuels(h))
 
-                    for n, v in periodes_graph.items():
-                        lim = ajd - pd.DateOffset(months=v) if v else df["date_facture"].min()
-                        h_tmp = df[(df["date_paiement"].notna()) & (df["date_facture"] >= lim)].copy()
-                        h_tmp["delai"] = (h_tmp["date_paiement"] - h_tmp["date_facture"]).dt.days
-                        if not h_tmp.empty:
-                            m = h_tmp.groupby("assureur")["delai"].mean().round(2).reset_index()
-                            m["Période"] = n
-                            evol_data.append(m)
-
-                    if evol_data:
-                        df_ev = pd.concat(evol_data)
-                        df_pv = df_ev.pivot(index="assureur", columns="Période", values="delai")
-                        cols_presentes = [c for c in ordre_chrono if c in df_pv.columns]
-                        df_pv = df_pv[cols_presentes]
-
+                    if not serie_delais.empty:
                         # --- Sélecteur de Top ---
                         options_top = {"Top 5": 5, "Top 10": 10, "Top 20": 20, "Global": None}
-                        col_top, col_spacer = st.columns([1, 3])
+                        col_top, col_mesure, col_lissage = st.columns([1, 2, 2])
                         with col_top:
                             top_choix = st.selectbox("Afficher :", list(options_top.keys()), index=0, key="evol_top")
+                        with col_mesure:
+                            mesure_evol = st.radio("Délai :", list(MESURES_DELAIS), horizontal=True, key="evol_mesure")
+                        with col_lissage:
+                            lissage = st.select_slider("Lissage (moyenne glissante) :", options=[1, 2, 3, 6], value=1, key="evol_lissage",
+                                                       format_func=lambda n: "Aucun" if n == 1 else f"{n} mois")
                         nb_top = options_top[top_choix]
-                        assureurs_disponibles = [a for a in tous_assureurs if a in df_pv.index]
+                        assureurs_serie = serie_delais.index.get_level_values("assureur").unique()
+                        assureurs_disponibles = [a for a in tous_assureurs if a in assureurs_serie]
                         defaut_sel = assureurs_disponibles[:nb_top] if nb_top else assureurs_disponibles
 
                         # Le key change selon le top choisi → force Streamlit à re-rendre
@@ -1046,18 +2287,20 @@ elif st.session_state.page == "factures":
                         _filtre_key = "_".join(sorted(sel_lois)) + "_" + "_".join(sorted(sel_fournisseurs))
                         assur_sel = st.multiselect(
                             "Sélectionner les assureurs :",
-                            options=df_pv.index.tolist(),
+                            options=assureurs_disponibles,
                             default=defaut_sel,
                             key=f"evol_assureurs_{top_choix}_{_filtre_key}"
                         )
                         if assur_sel:
-                            df_plot = df_pv.loc[assur_sel].T
-                            df_plot.index = pd.CategoricalIndex(df_plot.index, categories=ordre_chrono, ordered=True)
-                            df_plot_sorted = df_plot.sort_index()
-                            st.line_chart(df_plot_sorted)
-                            st.dataframe(df_pv.loc[assur_sel].style.highlight_max(axis=1, color='#ff9999').highlight_min(axis=1, color='#99ff99'))
+                            df_plot = courbes_delais(serie_delais, MESURES_DELAIS[mesure_evol], assur_sel, lissage)
+                            st.line_chart(df_plot, x_label="Mois de facturation", y_label=f"Délai ({mesure_evol.lower()}, jours)")
+                            st.caption(f"Délai de paiement des factures payées, par mois de facturation"
+                                       f"{f' — moyenne glissante sur {lissage} mois' if lissage > 1 else ''}. Tableau : 12 derniers mois.")
+                            df_table = df_plot.tail(12).T.rename_axis(index="Assureur", columns=None)
+                            df_table.columns = df_table.columns.strftime("%m.%Y")
+                            st.dataframe(df_table.style.highlight_max(axis=1, color='#ff9999').highlight_min(axis=1, color='#99ff99').format("{:.2f}", na_rep="—"))
                             try:
-                                _pdf_buf = generer_pdf_graphique_matplotlib("Évolution des délais de paiement", df_plot_sorted.reset_index().set_index("Période"), ylabel="Délai moyen (jours)")
+                                _pdf_buf = generer_pdf_graphique_matplotlib("Évolution des délais de paiement", df_plot, ylabel=f"Délai {mesure_evol.lower()} (jours)")
                                 st.download_button("📄 Télécharger le graphique en PDF", _pdf_buf, file_name="evolution_delais.pdf", mime="application/pdf", key="pdf_evol_graph", use_container_width=True)
                             except Exception as _e:
                                 st.caption(f"Export PDF indisponible : {_e}")
@@ -1098,48 +2341,32 @@ elif st.session_state.page == "medecins":
                     if v and v != 'nan':
                         mapping_cfg[v] = canon
             st.session_state.config_medecins = mapping_cfg
+            ecrire_config_base("config_medecins", pd.DataFrame({"variante": list(mapping_cfg), "canonique": list(mapping_cfg.values())}))
             st.sidebar.success(f"✅ {len(df_cfg)} médecins, {len(mapping_cfg)} variantes")
         except Exception as e:
             st.sidebar.error(f"Erreur : {e}")
 
     st.sidebar.markdown("---")
 
-    if uploaded_file:
+    # Base locale : fenêtre de ANNEES_BASE_PERFORMANCE ans (une facture est datée au plus tôt du jour de sa séance)
+    debut_base = debut_fenetre_base()
+    ds = export_courant(uploaded_file, {"prestations": {"colonnes": ["num_facture", "date_facture", "chiffre"], "debut": debut_base},
+                                        "factures": {"colonnes": ["num_facture", "medecin", "fournisseur", "loi", "tp_tg"], "debut": debut_base}})
+
+    if ds is not None:
         try:
-            @st.cache_data
-            def lire_medecins_prestations(f):
-                xl = pd.ExcelFile(f)
-                # Onglet Prestation (séances)
-                ong_prest = next((s for s in xl.sheet_names if s.strip().lower() == "prestation"), None) or                             next((s for s in xl.sheet_names if "prestation" in s.lower()), xl.sheet_names[0])
-                df_prest = pd.read_excel(f, sheet_name=ong_prest, header=0)
-                df_prest.columns = [str(c).strip() for c in df_prest.columns]
-                # Onglet Factures (médecins, fournisseurs, lois)
-                ong_fact = next((s for s in xl.sheet_names if s.strip().lower() == "factures"), None) or                            next((s for s in xl.sheet_names if "facture" in s.lower()), None)
-                if ong_fact is None:
-                    raise ValueError("Onglet 'Factures' introuvable dans ce fichier.")
-                df_fact = pd.read_excel(f, sheet_name=ong_fact, header=0)
-                df_fact.columns = [str(c).strip() for c in df_fact.columns]
-                return df_prest, df_fact
-
-            df_prest, df_fact = lire_medecins_prestations(uploaded_file)
-
-            # Résolution colonnes Factures
-            _cm = resoudre_colonnes(df_fact)
-            if _cm["fournisseur"] is None:
-                df_fact["Fournisseur de prestation"] = "Cabinet"
-                _cm["fournisseur"] = "Fournisseur de prestation"
+            df_prest, df_fact = onglet_export(ds, "prestations"), onglet_export(ds, "factures")
 
             # Jointure Prestation × Factures sur numéro de facture
-            col_num_prest = df_prest.columns[0]  # "Numéro de facture"
-            col_num_fact  = df_fact.columns[0]   # "Numéro de facture"
-            cols_fact_join = [col_num_fact, _cm["medecin"], _cm["fournisseur"], _cm["loi"], _cm["tp_tg"]]
-            df_brut = df_prest.merge(
-                df_fact[cols_fact_join].drop_duplicates(subset=[col_num_fact]),
-                left_on=col_num_prest, right_on=col_num_fact, how="left"
+            # (Prestation : date de séance et chiffre — Factures : médecins, fournisseurs, lois)
+            cols_fact_join = ["num_facture", "medecin", "fournisseur", "loi", "tp_tg"]
+            df_brut = df_prest[["num_facture", "date_facture", "chiffre"]].merge(
+                df_fact[cols_fact_join].drop_duplicates(subset=["num_facture"]),
+                on="num_facture", how="left"
             )
 
             # Bouton export config vierge basé sur les noms trouvés
-            noms_bruts = sorted(df_brut[_cm["medecin"]].dropna().astype(str).str.strip().unique().tolist())
+            noms_bruts = sorted(df_brut["medecin"].dropna().astype(str).str.strip().unique().tolist())
             df_export_cfg = pd.DataFrame({
                 "Nom canonique": noms_bruts,
                 "Variante 1": [""] * len(noms_bruts),
@@ -1159,19 +2386,15 @@ elif st.session_state.page == "medecins":
             )
 
             st.sidebar.header("🔍 Filtres")
-            fourn_med = sorted(df_brut[_cm["fournisseur"]].dropna().unique().tolist())
+            fourn_med = sorted(df_brut["fournisseur"].dropna().unique().tolist())
             sel_fourn_med = st.sidebar.multiselect("Fournisseurs :", fourn_med, default=fourn_med)
             seuil_jour_med = st.sidebar.number_input("Montant min. pour jour ouvert (CHF) :", min_value=0, max_value=500, value=50, step=10, key="seuil_med")
             exclure_mois_med = st.sidebar.toggle("Exclure le mois en cours", value=True, key="excl_mois_med")
-            df_m_init = df_brut[df_brut[_cm["tp_tg"]].astype(str).str.upper() != "TG"].copy()
-            df_m_init = df_m_init[df_m_init[_cm["fournisseur"]].isin(sel_fourn_med)]
-
-            # Colonnes Prestation pour date et montant (onglet Prestation)
-            col_date_prest   = df_prest.columns[1]   # "Date" (date séance)
-            col_chiffre_prest = df_prest.columns[11]  # "Chiffre"
+            df_m_init = df_brut[df_brut["tp_tg"].astype(str).str.upper() != "TG"].copy()
+            df_m_init = df_m_init[df_m_init["fournisseur"].isin(sel_fourn_med)]
 
             def moteur_fusion_securise(df):
-                noms_originaux = df[_cm["medecin"]].dropna().unique()
+                noms_originaux = df["medecin"].dropna().unique()
                 mapping = {}
                 def extraire_mots(texte):
                     mots = "".join(c if c.isalnum() else " " for c in str(texte)).upper().split()
@@ -1187,15 +2410,16 @@ elif st.session_state.page == "medecins":
                 return mapping
 
             regroupements = moteur_fusion_securise(df_m_init)
-            df_m_init[_cm["medecin"]] = df_m_init[_cm["medecin"]].replace(regroupements)
+            df_m_init["medecin"] = remapper_categories(df_m_init["medecin"], lambda m: regroupements.get(m, m))
 
             ajd = pd.Timestamp(datetime.today().date())
             # Fin du mois précédent — on exclut le mois en cours (incomplet)
             fin_mois_precedent = (ajd.replace(day=1) - pd.DateOffset(days=1))
-            df_m_init["medecin"] = df_m_init[_cm["medecin"]].fillna("Sans médecin").astype(str).str.strip()
-            # Utiliser date et montant de l'onglet Prestation (date de séance réelle)
-            df_m_init["ca"] = pd.to_numeric(df_m_init[col_chiffre_prest], errors="coerce").fillna(0)
-            df_m_init["date_f"] = df_m_init[col_date_prest].apply(convertir_date)
+            df_m_init["medecin"] = remapper_categories(
+                completer_categories(df_m_init["medecin"], ["Sans médecin"]).fillna("Sans médecin"), lambda m: str(m).strip())
+            # Utiliser date et montant de l'onglet Prestation (date de séance réelle, déjà convertie)
+            df_m_init["ca"] = df_m_init["chiffre"].fillna(0)
+            df_m_init["date_f"] = df_m_init["date_facture"]
             # Pour les calculs de tendance (taux CHF/j) : jusqu'à aujourd'hui
             df_m = df_m_init[
                 (df_m_init["ca"] > 0) &
@@ -1211,14 +2435,13 @@ elif st.session_state.page == "medecins":
                 st.caption(f"📅 Graphique jusqu'au {ajd.strftime('%d.%m.%Y')} — mois en cours inclus.")
             # Appliquer le mapping de la config cabinet (variantes → nom canonique)
             if st.session_state.config_medecins:
-                df_m["medecin"] = df_m["medecin"].replace(st.session_state.config_medecins)
+                df_m["medecin"] = remapper_categories(df_m["medecin"], lambda m: st.session_state.config_medecins.get(m, m))
                 nb_mapped = df_m["medecin"].isin(st.session_state.config_medecins.values()).sum()
                 if nb_mapped > 0:
                     st.caption(f"✅ Config cabinet active — {len(st.session_state.config_medecins)} variantes mappées")
             
             if not df_m.empty:
-                ca_par_jour = df_m.groupby(df_m["date_f"].dt.date)["ca"].sum()
-                jours_cabinet = set(ca_par_jour[ca_par_jour >= seuil_jour_med].index)
+                calendrier_med = calendrier_ouverture(df_m["date_f"], df_m["ca"], seuil_jour_med)
 
                 # --- Sélecteur de méthode de tendance ---
                 st.markdown("### 📊 Méthode de calcul de tendance")
@@ -1230,26 +2453,26 @@ elif st.session_state.page == "medecins":
                 annee_sur_annee = "précédente" in methode_tendance
 
                 t_60j = ajd - pd.DateOffset(days=60)
-                jo_60 = jours_ouvres(t_60j, ajd, jours_cabinet)
+                jo_60 = jours_ouvres(t_60j, ajd, calendrier_med)
 
                 if annee_sur_annee:
                     t_ref_fin   = ajd   - pd.DateOffset(years=1)
                     t_ref_debut = t_60j - pd.DateOffset(years=1)
                 if annee_sur_annee:
-                    jo_ref = jours_ouvres(t_ref_debut, t_ref_fin, jours_cabinet)
+                    jo_ref = jours_ouvres(t_ref_debut, t_ref_fin, calendrier_med)
                     label_ref = "CA même période N-1"
                     label_taux_ref = "Taux N-1 (CHF/j)"
-                    ca_ref = df_m[(df_m["date_f"] >= t_ref_debut) & (df_m["date_f"] <= t_ref_fin)].groupby("medecin")["ca"].sum().reset_index(name=label_ref)
+                    ca_ref = df_m[(df_m["date_f"] >= t_ref_debut) & (df_m["date_f"] <= t_ref_fin)].groupby("medecin", observed=True)["ca"].sum().reset_index(name=label_ref)
                 else:
                     t_365j = ajd - pd.DateOffset(days=365)
-                    jo_ref = jours_ouvres(t_365j, ajd, jours_cabinet)
+                    jo_ref = jours_ouvres(t_365j, ajd, calendrier_med)
                     label_ref = "CA 365j"
                     label_taux_ref = "Taux 365j (CHF/j)"
-                    ca_ref = df_m[df_m["date_f"] >= t_365j].groupby("medecin")["ca"].sum().reset_index(name=label_ref)
+                    ca_ref = df_m[df_m["date_f"] >= t_365j].groupby("medecin", observed=True)["ca"].sum().reset_index(name=label_ref)
 
-                stats_ca = df_m.groupby("medecin")["ca"].sum().reset_index(name="CA Global")
-                ca_60 = df_m[df_m["date_f"] >= t_60j].groupby("medecin")["ca"].sum().reset_index(name="CA 60j")
-                tab_final = stats_ca.merge(ca_ref, on="medecin", how="left").merge(ca_60, on="medecin", how="left").fillna(0)
+                stats_ca = df_m.groupby("medecin", observed=True)["ca"].sum().reset_index(name="CA Global")
+                ca_60 = df_m[df_m["date_f"] >= t_60j].groupby("medecin", observed=True)["ca"].sum().reset_index(name="CA 60j")
+                tab_final = stats_ca.merge(ca_ref, on="medecin", how="left").merge(ca_60, on="medecin", how="left").fillna({label_ref: 0, "CA 60j": 0})
                 tab_final["Taux 60j (CHF/j)"]  = (tab_final["CA 60j"] / jo_60).round(2)
                 tab_final[label_taux_ref] = (tab_final[label_ref] / jo_ref).round(2)
                 tab_final["Tendance"] = tab_final.apply(
@@ -1269,7 +2492,7 @@ elif st.session_state.page == "medecins":
                 if choix:
                     df_p = df_m_graph[df_m_graph["medecin"].isin(choix)].copy()
                     df_p["M_Date"] = df_p["date_f"].dt.to_period("M").dt.to_timestamp()
-                    df_p = df_p.groupby(["M_Date", "medecin"])["ca"].sum().reset_index()
+                    df_p = df_p.groupby(["M_Date", "medecin"], observed=True)["ca"].sum().reset_index()
                     base = alt.Chart(df_p).encode(
                         x=alt.X('M_Date:T', title="Mois", axis=alt.Axis(format='%m.%Y')),
                         y=alt.Y('ca:Q', title="CA (CHF)"),
@@ -1280,7 +2503,7 @@ elif st.session_state.page == "medecins":
                     chart = data_layer if visibility == "Données" else trend_layer if visibility == "Ligne" else data_layer + trend_layer
                     st.altair_chart(chart, use_container_width=True)
                     try:
-                        _df_med_chart = df_p.groupby(["M_Date", "medecin"])["ca"].sum().unstack(fill_value=0)
+                        _df_med_chart = df_p.groupby(["M_Date", "medecin"], observed=True)["ca"].sum().unstack(fill_value=0)
                         _pdf_buf = generer_pdf_graphique_matplotlib("CA par médecin", _df_med_chart, sous_titre=f"Calculé au {datetime.today().strftime('%d.%m.%Y')}", ylabel="CA (CHF)")
                         st.download_button("📄 Télécharger le graphique en PDF", _pdf_buf, file_name="medecins_graphique.pdf", mime="application/pdf", key="pdf_med_graph", use_container_width=True)
                     except Exception as _e:
@@ -1324,19 +2547,16 @@ elif st.session_state.page == "tarifs":
     st.title("📊 Analyse des revenus mensuels et Tendances")
     uploaded_file = st.sidebar.file_uploader("📂 Déposer l'export Excel (onglet 'Prestation')", type="xlsx", key="tarif_up")
 
-    if uploaded_file:
+    ds = export_courant(uploaded_file, {"prestations": {"colonnes": ["code_tarifaire", "description", "chiffre", "date_facture"],
+                                                        "conditions": ["chiffre > 0", "date_facture IS NOT NULL"],
+                                                        "debut": debut_fenetre_base()}})
+
+    if ds is not None:
         try:
-            ong_p = next((s for s in pd.ExcelFile(uploaded_file).sheet_names if 'Prestation' in s or 'prestation' in s.lower()), 'Prestation')
-            df = pd.read_excel(uploaded_file, sheet_name=ong_p)
-            nom_col_code = df.columns[2]   # C (Tarif)
-            df[nom_col_code] = df[nom_col_code].apply(nettoyer_code_tarif)
-            nom_col_nom  = df.columns[3]   # D (Nom de la prestation)
-            nom_col_somme = df.columns[11] # L (Montant)
-            date_cols = [c for c in df.columns if 'Date' in str(c)]
-            nom_col_date = date_cols[0] if date_cols else df.columns[0]
-
-            df[nom_col_somme] = pd.to_numeric(df[nom_col_somme], errors='coerce')
-            df[nom_col_date] = pd.to_datetime(df[nom_col_date], errors='coerce')
+            df = onglet_export(ds, "prestations")
+            # Colonnes logiques de l'onglet Prestation (codes nettoyés, dates et montants typés à l'ingestion)
+            nom_col_code, nom_col_nom = "code_tarifaire", "description"
+            nom_col_somme, nom_col_date = "chiffre", "date_facture"
             df = df[df[nom_col_somme] > 0].dropna(subset=[nom_col_date, nom_col_somme])
             
             # --- GESTION DE LA PÉRIODE ET AFFICHAGE ---
@@ -1352,7 +2572,7 @@ elif st.session_state.page == "tarifs":
             else:
                 reference_date = maintenant
 
-            df['Profession'] = df[nom_col_code].apply(assigner_profession)
+            df['Profession'] = professions_par_code(df[nom_col_code])
 
             # --- FILTRAGE ---
             st.sidebar.header("⚙️ Filtres")
@@ -1372,20 +2592,21 @@ elif st.session_state.page == "tarifs":
                 horizontal=True, key="methode_tarif"
             )
 
-            df_filtered = df[df[nom_col_code].astype(str).isin(selection_codes)].copy()
+            df_filtered = df[df[nom_col_code].isin(selection_codes)].copy()
 
             if not df_filtered.empty:
                 # 1. GRAPHIQUE D'ÉVOLUTION
                 df_filtered['Mois'] = df_filtered[nom_col_date].dt.to_period('M').dt.to_timestamp()
                 target_col = "Profession" if view_mode == "Profession" else nom_col_code
-                df_plot = df_filtered.groupby(['Mois', target_col])[nom_col_somme].sum().reset_index()
+                df_plot = df_filtered.groupby(['Mois', target_col], observed=True)[nom_col_somme].sum().reset_index()
                 
                 color_map = COULEURS_PROF if view_mode == "Profession" else None
+                libelles = {nom_col_somme: "CA (CHF)", nom_col_code: "Code tarifaire"}
                 if chart_type == "Barres":
-                    fig = px.bar(df_plot, x='Mois', y=nom_col_somme, color=target_col, 
+                    fig = px.bar(df_plot, x='Mois', y=nom_col_somme, color=target_col, labels=libelles,
                                  barmode='group', color_discrete_map=color_map, text_auto='.2f')
                 else:
-                    fig = px.line(df_plot, x='Mois', y=nom_col_somme, color=target_col, 
+                    fig = px.line(df_plot, x='Mois', y=nom_col_somme, color=target_col, labels=libelles,
                                   markers=True, color_discrete_map=color_map)
                 
                 # Application de la logique d'axe Y
@@ -1410,25 +2631,24 @@ elif st.session_state.page == "tarifs":
                 # 2. TABLEAU DES TENDANCES
                 st.markdown(f"### 📈 Performance par Tarif (Base : {reference_date.strftime('%d.%m.%Y')})")
 
-                ca_par_jour_t = df.groupby(df[nom_col_date].dt.date)[nom_col_somme].sum()
-                jours_cabinet_t = set(ca_par_jour_t[ca_par_jour_t >= seuil_jour_tar].index)  # Jours réels du cabinet avec min de facturation
+                calendrier_t = calendrier_ouverture(df[nom_col_date], df[nom_col_somme], seuil_jour_tar)  # Jours réels du cabinet avec min de facturation
                 annee_sur_annee_t = "précédente" in methode_tarif
 
                 t_60j = reference_date - pd.DateOffset(days=60)
-                jo_60 = jours_ouvres(t_60j, reference_date, jours_cabinet_t)
+                jo_60 = jours_ouvres(t_60j, reference_date, calendrier_t)
 
                 if annee_sur_annee_t:
                     t_ref_fin   = reference_date - pd.DateOffset(years=1)
                     t_ref_debut = t_60j          - pd.DateOffset(years=1)
                 if annee_sur_annee_t:
-                    jo_ref      = jours_ouvres(t_ref_debut, t_ref_fin, jours_cabinet_t)
+                    jo_ref      = jours_ouvres(t_ref_debut, t_ref_fin, calendrier_t)
                     label_ref   = "CA même période N-1"
-                    ca_ref = df_filtered[(df_filtered[nom_col_date] >= t_ref_debut) & (df_filtered[nom_col_date] <= t_ref_fin)].groupby(nom_col_code)[nom_col_somme].sum().reset_index(name=label_ref)
+                    ca_ref = df_filtered[(df_filtered[nom_col_date] >= t_ref_debut) & (df_filtered[nom_col_date] <= t_ref_fin)].groupby(nom_col_code, observed=True)[nom_col_somme].sum().reset_index(name=label_ref)
                 else:
                     t_365j      = reference_date - pd.DateOffset(days=365)
-                    jo_ref      = jours_ouvres(t_365j, reference_date, jours_cabinet_t)
+                    jo_ref      = jours_ouvres(t_365j, reference_date, calendrier_t)
                     label_ref   = "CA 365j"
-                    ca_ref = df_filtered[df_filtered[nom_col_date] >= t_365j].groupby(nom_col_code)[nom_col_somme].sum().reset_index(name=label_ref)
+                    ca_ref = df_filtered[df_filtered[nom_col_date] >= t_365j].groupby(nom_col_code, observed=True)[nom_col_somme].sum().reset_index(name=label_ref)
 
                 label_taux_ref = "Taux N-1 (CHF/j)" if annee_sur_annee_t else "Taux 365j (CHF/j)"
 
@@ -1436,14 +2656,14 @@ elif st.session_state.page == "tarifs":
                 group_col = "Profession" if view_mode == "Profession" else nom_col_code
 
                 if annee_sur_annee_t:
-                    ca_ref_g = df_filtered[(df_filtered[nom_col_date] >= t_ref_debut) & (df_filtered[nom_col_date] <= t_ref_fin)].groupby(group_col)[nom_col_somme].sum().reset_index(name=label_ref)
+                    ca_ref_g = df_filtered[(df_filtered[nom_col_date] >= t_ref_debut) & (df_filtered[nom_col_date] <= t_ref_fin)].groupby(group_col, observed=True)[nom_col_somme].sum().reset_index(name=label_ref)
                 else:
-                    ca_ref_g = df_filtered[df_filtered[nom_col_date] >= t_365j].groupby(group_col)[nom_col_somme].sum().reset_index(name=label_ref)
+                    ca_ref_g = df_filtered[df_filtered[nom_col_date] >= t_365j].groupby(group_col, observed=True)[nom_col_somme].sum().reset_index(name=label_ref)
 
-                stats_global = df_filtered.groupby(group_col)[nom_col_somme].sum().reset_index(name="CA Global")
-                ca_60_g      = df_filtered[df_filtered[nom_col_date] >= t_60j].groupby(group_col)[nom_col_somme].sum().reset_index(name="CA 60j")
+                stats_global = df_filtered.groupby(group_col, observed=True)[nom_col_somme].sum().reset_index(name="CA Global")
+                ca_60_g      = df_filtered[df_filtered[nom_col_date] >= t_60j].groupby(group_col, observed=True)[nom_col_somme].sum().reset_index(name="CA 60j")
 
-                tab_perf = stats_global.merge(ca_ref_g, on=group_col, how="left").merge(ca_60_g, on=group_col, how="left").fillna(0)
+                tab_perf = stats_global.merge(ca_ref_g, on=group_col, how="left").merge(ca_60_g, on=group_col, how="left").fillna({label_ref: 0, "CA 60j": 0})
                 tab_perf["Taux 60j (CHF/j)"] = (tab_perf["CA 60j"]  / jo_60).round(2)
                 tab_perf[label_taux_ref]      = (tab_perf[label_ref] / jo_ref).round(2)
                 tab_perf["Tendance"] = tab_perf.apply(
@@ -1453,7 +2673,7 @@ elif st.session_state.page == "tarifs":
                 # Pour le mode code : ajouter le nom de la prestation en tooltip
                 if view_mode != "Profession":
                     noms_prestation = (
-                        df_filtered.groupby(nom_col_code)[nom_col_nom]
+                        df_filtered.groupby(nom_col_code, observed=True)[nom_col_nom]
                         .agg(lambda x: x.mode().iloc[0] if not x.mode().empty else "")
                         .reset_index().rename(columns={nom_col_nom: "Prestation"})
                     )
@@ -1553,47 +2773,52 @@ elif st.session_state.page == "bilan":
     st.title("🏦 Bilan des Revenus par Fournisseur")
     up = st.sidebar.file_uploader("Fichier Excel (Export avec onglet Facture)", type="xlsx", key="bilan_up")
     
-    if up:
+    # En mode base, rien n'est lu ici : les années puis l'exercice choisi sont interrogés dans SQLite
+    ds = export_courant(up, {})
+
+    if ds is not None:
         try:
-            xl = pd.ExcelFile(up)
-            ong_f = next((s for s in xl.sheet_names if 'Facture' in s or 'facture' in s.lower()), None)
-            
-            if not ong_f:
-                st.error(f"L'onglet 'Facture' est introuvable. Onglets disponibles : {', '.join(xl.sheet_names)}")
-                st.stop()
-            
-            df_f = pd.read_excel(up, sheet_name=ong_f)
-            
-           # --- CONFIGURATION DES COLONNES ---
-            col_date_f = df_f.columns[2]   # C: Date de la facture
-            col_fourn_f = df_f.columns[9]  # J: Fournisseur
-            col_ca_f = df_f.columns[14]    # O: Montant (CA)
-            col_paye_f = df_f.columns[15]  # P: Date de paiement
-            
-            df_f[col_date_f] = pd.to_datetime(df_f[col_date_f], errors='coerce')
-            df_f[col_ca_f] = pd.to_numeric(df_f[col_ca_f], errors='coerce').fillna(0)
-            df_f = df_f.dropna(subset=[col_date_f])
+           # --- CONFIGURATION DES COLONNES (résolues à l'ingestion) ---
+            col_date_f = "date_facture"   # Date de la facture
+            col_fourn_f = "fournisseur"   # Fournisseur
+            col_ca_f = "montant"          # Montant (CA)
+            col_paye_f = "date_paiement"  # Date de paiement
+
+            if ds.get("base"):
+                annees = annees_base("factures")
+                if not annees:
+                    st.error("Aucune facture datée dans la base locale.")
+                    st.stop()
+            else:
+                df_f = onglet_export(ds, "factures")
 
-            # Extraction des années uniques
-            annees = sorted(df_f[col_date_f].dt.year.unique().astype(int), reverse=True)
-            
-            # --- NOUVEAU : ALERTE MULTI-ANNÉES ---
-            if len(annees) > 1:
-                st.warning(
-                    f"⚠️ **Attention :** L'export chargé contient des données sur {len(annees)} années différentes "
-                    f"({min(annees)} à {max(annees)}). Le bilan est conçu pour analyser un exercice comptable unique. "
-                    "Veuillez faire un export des prestations du 1er janvier au 31 décembre d'une seule année."
-                )
+                df_f = df_f.dropna(subset=[col_date_f]).assign(**{col_ca_f: lambda d: d[col_ca_f].fillna(0)})
+
+                # Extraction des années uniques
+                annees = sorted(df_f[col_date_f].dt.year.unique().astype(int), reverse=True)
+
+                # --- NOUVEAU : ALERTE MULTI-ANNÉES ---
+                if len(annees) > 1:
+                    st.warning(
+                        f"⚠️ **Attention :** L'export chargé contient des données sur {len(annees)} années différentes "
+                        f"({min(annees)} à {max(annees)}). Le bilan est conçu pour analyser un exercice comptable unique. "
+                        "Veuillez faire un export des prestations du 1er janvier au 31 décembre d'une seule année."
+                    )
 
             annee = st.sidebar.selectbox("Année d'analyse :", annees)
-            df_sel = df_f[df_f[col_date_f].dt.year == annee].copy()
+            if ds.get("base"):
+                df_sel = lire_base("factures", [col_date_f, col_fourn_f, col_ca_f, col_paye_f],
+                                   debut=f"{annee}-01-01", fin=f"{annee + 1}-01-01")
+                df_sel[col_ca_f] = df_sel[col_ca_f].fillna(0)
+            else:
+                df_sel = df_f[df_f[col_date_f].dt.year == annee].copy()
 
             # --- SECTION CHIFFRE D'AFFAIRES ---
             st.subheader(f"📊 Analyse du Chiffre d'Affaires ({annee})")
             vue_ca = st.radio("Affichage CA par Fournisseur :", ["Annuel (Cumulé)", "Mensuel (Détail)"], horizontal=True)
 
             if vue_ca == "Annuel (Cumulé)":
-                ca_fourn = df_sel.groupby(col_fourn_f)[col_ca_f].sum().round(2).sort_values(ascending=False).reset_index()
+                ca_fourn = df_sel.groupby(col_fourn_f, observed=True)[col_ca_f].sum().round(2).sort_values(ascending=False).reset_index()
                 
                 # Ajout de la ligne Total pour le cumul annuel
                 total_val = ca_fourn[col_ca_f].sum()
@@ -1615,7 +2840,7 @@ elif st.session_state.page == "bilan":
                 df_sel['Mois_Num'] = df_sel[col_date_f].dt.month
                 nom_mois = ["Jan", "Fév", "Mar", "Avr", "Mai", "Jun", "Jul", "Août", "Sep", "Oct", "Nov", "Déc"]
                 
-                pivot_fourn = df_sel.pivot_table(index=col_fourn_f, columns='Mois_Num', values=col_ca_f, aggfunc='sum', fill_value=0)
+                pivot_fourn = df_sel.pivot_table(index=col_fourn_f, columns='Mois_Num', values=col_ca_f, aggfunc='sum', fill_value=0, observed=True)
                 pivot_fourn = pivot_fourn.reindex(columns=range(1, 13), fill_value=0)
                 pivot_fourn.columns = nom_mois
                 pivot_fourn = pivot_fourn.round(2)
@@ -1638,7 +2863,7 @@ elif st.session_state.page == "bilan":
 
             if total_impayes > 0:
                 st.warning(f"Montant total restant à percevoir pour {annee} : **{chf(total_impayes)} CHF**")
-                imp_par_fourn = df_impayes.groupby(col_fourn_f)[col_ca_f].sum().sort_values(ascending=False).reset_index()
+                imp_par_fourn = df_impayes.groupby(col_fourn_f, observed=True)[col_ca_f].sum().sort_values(ascending=False).reset_index()
                 
                 # Ajout de la ligne Total aussi pour les impayés
                 ligne_total_imp = pd.DataFrame({col_fourn_f: ['TOTAL DES IMPAYÉS'], col_ca_f: [total_impayes]})
@@ -1714,29 +2939,17 @@ elif st.session_state.page == "retrocession":
         key="retro_periode_mode"
     )
 
-    if uploaded_retro:
+    ds = export_courant(uploaded_retro, {"prestations": {"colonnes": ["date_facture", "code_tarifaire", "chiffre", "num_patient"],
+                                                         "conditions": ["chiffre > 0"]}})
+
+    if ds is not None:
         try:
-            @st.cache_data
-            def lire_retro(f):
-                df = pd.read_excel(f, sheet_name=None)
-                # Chercher onglet Prestation (insensible casse)
-                for k in df:
-                    if k.strip().lower() == "prestation":
-                        return df[k]
-                return list(df.values())[0]
-
-            df_r = lire_retro(uploaded_retro)
-            df_r.columns = [str(c).strip() for c in df_r.columns]
-
-            # Colonnes export Ephysio Prestations — détection par nom
-            _cr = resoudre_colonnes(df_r)
-            c_date = _cr["date_facture"] or df_r.columns[1]
-            c_code = df_r.columns[2]   # Code tarifaire toujours col 2 dans Prestations
-            c_mont = _cr["chiffre"] or _cr["montant"] or df_r.columns[11]
-
-            df_r[c_date] = pd.to_datetime(df_r[c_date], errors="coerce")
-            df_r[c_mont] = pd.to_numeric(df_r[c_mont], errors="coerce").fillna(0)
-            df_r[c_code] = df_r[c_code].apply(nettoyer_code_tarif)
+            df_r = onglet_export(ds, "prestations")
+
+            # Colonnes export Ephysio Prestations — résolues et typées à l'ingestion
+            c_date = "date_facture"
+            c_code = "code_tarifaire"
+            c_mont = "chiffre"
 
             # Garder uniquement les lignes avec montant positif
             df_r = df_r[(df_r[c_mont] > 0) & df_r[c_date].notna()].copy()
@@ -1767,7 +2980,7 @@ elif st.session_state.page == "retrocession":
                 st.stop()
 
             # Colonne patient (col 8, index 8)
-            c_pat = _cr["num_patient"] or _cr["patient"] or df_r.columns[8]
+            c_pat = "num_patient"
 
             # --- DÉTECTION PAIRES 7311/7354 (séances à domicile) ---
             # Une paire domicile = même jour + même patient + présence de 7311 ET 7354
@@ -1796,10 +3009,11 @@ elif st.session_state.page == "retrocession":
                 st.info(f"🏠 **{nb_domicile_7311 + nb_domicile_7301} séances à domicile détectées** — séparées dans la grille ci-dessous.")
 
             # --- AGRÉGAT PAR CODE ---
-            agg = df_f.groupby(c_code).agg(
+            agg = df_f.groupby(c_code, observed=True).agg(
                 CA=(c_mont, "sum"),
                 Nb_lignes=(c_mont, "count")
             ).reset_index().rename(columns={c_code: "Code"})
+            agg["Code"] = agg["Code"].astype(str)
 
             # Remplacer les lignes 7311 et 7301 par des versions split cabinet/domicile
             rows_extra = []
@@ -1834,6 +3048,11 @@ elif st.session_state.page == "retrocession":
                         st.sidebar.success(f"✅ {len(taux_precharges)} taux chargés")
                 except Exception as e:
                     st.sidebar.error(f"Erreur grille : {e}")
+            else:
+                grille_base = lire_config_base("grille_retrocession")
+                if grille_base is not None:
+                    taux_precharges = dict(zip(grille_base["Code"], grille_base["Taux (%)"]))
+                    st.sidebar.caption(f"🗄️ {len(taux_precharges)} taux repris de la base locale")
 
             # --- INTERFACE PRINCIPALE ---
             st.subheader(f"📋 Grille de rétrocession — {label_periode}")
@@ -1880,6 +3099,7 @@ elif st.session_state.page == "retrocession":
             # --- CALCUL ---
             st.markdown("---")
             if st.button("🧮 Calculer la rétrocession", type="primary", use_container_width=True):
+                ecrire_config_base("grille_retrocession", edited[["Code", "Taux (%)"]])
 
                 edited["Rétrocession (CHF)"] = (edited["CA (CHF)"] * edited["Taux (%)"] / 100).round(2)
                 detail = edited[edited["Taux (%)"] > 0].copy()
@@ -1961,5 +3181,5 @@ elif st.session_state.page == "retrocession":
 
         except Exception as e:
             st.error(f"❌ Erreur : {e}")
-    else:
+    elif uploaded_retro is None:
         st.info("👈 Chargez l'export Prestations du/de la thérapeute dans la sidebar pour commencer.")
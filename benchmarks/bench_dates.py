@@ -0,0 +1,43 @@
+"""Temps de conversion d'une colonne de dates : ancienne conversion cellule par cellule contre convertir_dates.
+
+    python benchmarks/bench_dates.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.conftest import charger_app  # noqa: E402
+from tests.test_dates import convertir_date_historique  # noqa: E402
+
+
+def colonne(n, graine=0):
+    """n cellules : 70 % de textes jj.mm.aaaa, 20 % de Timestamp, 10 % de vides."""
+    rng = np.random.default_rng(graine)
+    jours = pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 2000, n), "D")
+    tirage = rng.random(n)
+    valeurs = np.where(tirage < 0.7, jours.strftime("%d.%m.%Y"), "").astype(object)
+    valeurs[(tirage >= 0.7) & (tirage < 0.9)] = list(jours[(tirage >= 0.7) & (tirage < 0.9)])
+    return pd.Series(valeurs, dtype=object)
+
+
+def main():
+    app = charger_app()
+    print(f"{'cellules':>9} {'apply (s)':>10} {'vectorisé (s)':>14}")
+    for n in (20_000, 200_000):
+        serie = colonne(n)
+        debut = time.perf_counter()
+        ancien = serie.apply(convertir_date_historique)
+        t_ancien = time.perf_counter() - debut
+        debut = time.perf_counter()
+        nouveau = app["convertir_dates"](serie)
+        t_nouveau = time.perf_counter() - debut
+        assert ancien.astype("datetime64[ns]").equals(nouveau)
+        print(f"{n:>9} {t_ancien:>10.2f} {t_nouveau:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Temps de simuler_encaissements (NB_SCENARIOS scénarios) selon le nombre de factures en attente et de délais.
+
+    python benchmarks/bench_simulation.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.conftest import charger_app  # noqa: E402
+
+AJD = pd.Timestamp("2026-06-30")
+
+
+def historique(n, graine=0):
+    """n factures sur deux ans, quatre assureurs et deux fournisseurs, environ un tiers encore en attente."""
+    rng = np.random.default_rng(graine)
+    df = pd.DataFrame({"assureur": rng.choice(["A1", "A2", "A3", "A4"], n), "fournisseur": rng.choice(["F1", "F2"], n),
+                       "montant": rng.uniform(10, 500, n),
+                       "date_facture": AJD - pd.to_timedelta(rng.integers(0, 730, n), "D")})
+    df["date_paiement"] = (df["date_facture"] + pd.to_timedelta(rng.integers(0, 120, n), "D")).where(rng.random(n) < 0.7)
+    df.loc[df["date_paiement"] > AJD, "date_paiement"] = pd.NaT
+    df["statut"] = np.where(df["date_paiement"].notna(), "payé", "en attente")
+    return df
+
+
+def main():
+    app = charger_app()
+    print(f"{'factures':>9} {'délais':>7} {'horizon':>8} {'secondes':>9}")
+    for nb_attente in (2000, 5000, 7000, 10000):
+        df = historique(nb_attente * 3)
+        modele = app["survie_paiements"](df, AJD)
+        f_att = df[df["statut"] == "en attente"].iloc[:nb_attente].copy()
+        f_att["delai_actuel"] = (AJD - f_att["date_facture"]).dt.days
+        for horizon in (30, 180, 365):
+            jours = sorted(set(range(7, horizon, 7)) | {horizon})
+            debut = time.perf_counter()
+            app["simuler_encaissements"](f_att, modele, jours)
+            print(f"{len(f_att):>9} {len(jours):>7} {horizon:>8} {time.perf_counter() - debut:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
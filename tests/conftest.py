@@ -0,0 +1,28 @@
+"""Chargement de app.py pour les tests : fonctions et constantes seulement, sans exécuter les pages Streamlit."""
+import ast
+import os
+
+import pytest
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def charger_source(source, fichier):
+    """Imports, fonctions et constantes (noms en majuscules) de premier niveau d'un source, exécutés à part."""
+    arbre = ast.parse(source)
+    gardes = [n for n in arbre.body
+              if isinstance(n, (ast.Import, ast.ImportFrom, ast.FunctionDef))
+              or (isinstance(n, ast.Assign) and all(isinstance(t, ast.Name) and t.id.isupper() for t in n.targets))]
+    ns = {"__name__": "app"}
+    exec(compile(ast.Module(body=gardes, type_ignores=[]), fichier, "exec"), ns)
+    return ns
+
+
+def charger_app():
+    return charger_source(open(APP, encoding="utf-8").read(), APP)
+
+
+@pytest.fixture(scope="module")
+def app():
+    """Espace de noms propre à chaque module de test (les tests peuvent modifier ses constantes)."""
+    return charger_app()
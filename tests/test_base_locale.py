@@ -0,0 +1,45 @@
+"""Base locale : un même export versé deux fois, n° de facture lus en nombres puis en texte, ne crée aucun doublon."""
+import io
+import sqlite3
+
+from openpyxl import Workbook
+
+
+def classeur(numero):
+    """Export Ephysio minimal (Prestation + Factures) ; numero(n) donne le n° de facture tel qu'écrit dans la cellule."""
+    wb = Workbook()
+    prest = wb.active
+    prest.title = "Prestation"
+    prest.append(["Numéro de facture", "Date", "Code tarifaire", "Description du tarif", "Quantité", "Nombre de points",
+                  "Valeur du point", "Thérapeute", "#Patient", "Patient", "Facturation", "Chiffre CHF"])
+    for i in range(12):
+        prest.append([numero(1000 + i // 2), "03.02.2025", "7301", "Séance", 1, 48, 1, "T1", 5, "P", "x", 48.0])
+    fact = wb.create_sheet("Factures")
+    fact.append(["Numéro de facture", "#Patient", "Date", "Patient", "Loi", "TP/TG", "Médecin prescripteur", "Assurance",
+                 "Statut", "Fournisseur de prestation", "a", "b", "c", "d", "Montant CHF", "Date payment",
+                 "Montant payment", "Chiffre CHF"])
+    for i in range(6):
+        fact.append([numero(1000 + i), 5, "03.02.2025", "P", "LAMal", "TP", "Dr X", "CSS", "payé", "F1",
+                     None, None, None, None, 96.0, "03.03.2025", 96.0, 96.0])
+    buf = io.BytesIO()
+    wb.save(buf)
+    buf.seek(0)
+    buf.name = "export.xlsx"
+    return buf
+
+
+def test_meme_export_nombres_puis_texte_sans_doublon(app, tmp_path):
+    chemin = str(tmp_path / "base.sqlite")
+    app["CHEMIN_BASE"] = chemin
+    ds_nombres = app["lire_export"](classeur(int))
+    ds_texte = app["lire_export"](classeur(lambda n: f" {n} "))
+
+    app["enregistrer_export_base"]("nombres", ds_nombres)
+    app["enregistrer_export_base"]("texte", ds_texte)
+
+    with sqlite3.connect(chemin) as con:
+        assert con.execute("SELECT COUNT(*) FROM prestations").fetchone()[0] == 12
+        assert con.execute("SELECT COUNT(*) FROM factures").fetchone()[0] == 6
+        assert con.execute("SELECT COUNT(*) FROM exports").fetchone()[0] == 2
+    factures = app["lire_base"]("factures", ["num_facture"])
+    assert sorted(factures["num_facture"].astype(str)) == [str(n) for n in range(1000, 1006)]
@@ -0,0 +1,46 @@
+"""convertir_dates : mêmes résultats que l'ancienne conversion cellule par cellule, à un écart documenté près."""
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+
+def convertir_date_historique(val):
+    """Ancienne conversion d'une cellule, appliquée ligne par ligne avant la version vectorisée."""
+    if pd.isna(val) or str(val).strip() == "": return pd.NaT
+    if isinstance(val, pd.Timestamp): return val
+    try:
+        return pd.to_datetime(str(val).strip(), format="%d.%m.%Y", errors="coerce")
+    except Exception:
+        return pd.to_datetime(val, errors="coerce")
+
+
+COMPARABLES = ["01.02.2024", " 15.03.2023 ", "1.2.2024", "31.12.1999", "31.02.2024", "2024-13-01", "2024-01-13",
+               "13/01/2024", "01.02.2024 10:30", "janvier", "", "   ", "nan", None, np.nan, pd.NaT, 5, 3.5,
+               pd.Timestamp("2024-05-06"), pd.Timestamp("2024-05-06 14:00")]
+
+
+def test_identique_a_l_ancienne_conversion(app):
+    serie = pd.Series(COMPARABLES, dtype=object, index=range(10, 10 + len(COMPARABLES)), name="date")
+    res = app["convertir_dates"](serie)
+    attendu = pd.Series([convertir_date_historique(v) for v in COMPARABLES], index=serie.index, name="date",
+                        dtype="datetime64[ns]")
+    pd.testing.assert_series_equal(res, attendu)
+
+
+def test_pas_d_analyse_generique(app):
+    res = app["convertir_dates"](pd.Series(["2024-13-01", "2024-01-13", "13 janvier 2024"], dtype=object))
+    assert res.isna().all()
+
+
+def test_ecart_documente_valeurs_deja_datees(app):
+    """Cellules Excel lues par openpyxl : l'ancienne version rendait NaT, la nouvelle garde la date."""
+    valeurs = [datetime(2024, 5, 6, 14, 0), date(2024, 5, 6), np.datetime64("2024-05-06")]
+    assert all(pd.isna(convertir_date_historique(v)) for v in valeurs)
+    res = app["convertir_dates"](pd.Series(valeurs, dtype=object))
+    assert list(res) == [pd.Timestamp("2024-05-06 14:00"), pd.Timestamp("2024-05-06"), pd.Timestamp("2024-05-06")]
+
+
+def test_colonne_deja_datee_inchangee(app):
+    serie = pd.Series(pd.to_datetime(["2024-01-01", None]), name="d")
+    assert app["convertir_dates"](serie) is serie
@@ -0,0 +1,99 @@
+"""Encaissements attendus des factures en attente : courbes de survie, courbe attendue et simulation de Monte Carlo."""
+import numpy as np
+import pandas as pd
+
+AJD = pd.Timestamp("2026-06-30")
+
+
+def factures(n, graine=1):
+    """Historique de factures de deux fournisseurs et trois assureurs (dont un inconnu), 80 % payées."""
+    rng = np.random.default_rng(graine)
+    df = pd.DataFrame({"assureur": rng.choice(["A1", "A2", None], n), "fournisseur": rng.choice(["F1", "F2"], n),
+                       "montant": rng.uniform(10, 500, n),
+                       "date_facture": AJD - pd.to_timedelta(rng.integers(0, 300, n), "D")})
+    df["date_paiement"] = (df["date_facture"] + pd.to_timedelta(rng.integers(0, 90, n), "D")).where(rng.random(n) < 0.8)
+    df.loc[df["date_paiement"] > AJD, "date_paiement"] = pd.NaT
+    df["statut"] = np.where(df["date_paiement"].notna(), "payé", "en attente")
+    return df
+
+
+def en_attente(df):
+    f_att = df[df["statut"] == "en attente"].copy()
+    f_att["delai_actuel"] = (AJD - f_att["date_facture"]).dt.days
+    return f_att
+
+
+def petit_historique():
+    """Sept factures calculables à la main (assureur, fournisseur, âge, délai de paiement ou None, statut)."""
+    lignes = [("A", "F", 20, 2, "payé"), ("A", "F", 20, 2, "payé"), ("A", "F", 3, None, "en attente"),
+              ("A", "F", 20, 5, "payé"), ("A", "F", 1, None, "en attente"),
+              ("B", "F", 20, 1, "payé"), ("B", "F", 4, None, "en attente 2"),
+              # Hors modèle : annulée, et en attente annulée
+              ("A", "F", 2, None, "annulé"), ("B", "F", 9, None, "en attente (annulé)")]
+    df = pd.DataFrame(lignes, columns=["assureur", "fournisseur", "age", "delai", "statut"])
+    df["date_facture"] = AJD - pd.to_timedelta(df["age"], "D")
+    df["date_paiement"] = df["date_facture"] + pd.to_timedelta(df["delai"], "D")
+    df["montant"] = 100.0
+    return df
+
+
+def courbe(modele, niveau, **cles):
+    """Ligne de la matrice de survie d'un niveau (« croisees », « fournisseurs », « global »)."""
+    noms, table, debut = modele["niveaux"][niveau]
+    if not noms:
+        return modele["survie"][debut]
+    ligne = table.index[(table[noms] == pd.Series(cles)[noms]).all(axis=1)][0]
+    return modele["survie"][debut + ligne]
+
+
+def test_survie_kaplan_meier_a_la_main(app):
+    modele = app["survie_paiements"](petit_historique(), AJD)
+    assert modele["nb_jours"] == 6
+    # (A, F) : payées à 2, 2, 5 jours ; censurées à 3 et 1 jour.
+    # À risque 5, 5, 4, 2, 1, 1 ; paiements 0, 0, 2, 0, 0, 1
+    np.testing.assert_allclose(courbe(modele, "croisees", assureur="A", fournisseur="F"), [1, 1, 1 / 2, 1 / 2, 1 / 2, 0])
+    # (B, F) : payée à 1 jour, censurée à 4 ; plus personne à risque au jour 5, la survie reste à 1/2
+    np.testing.assert_allclose(courbe(modele, "croisees", assureur="B", fournisseur="F"), [1, 1 / 2, 1 / 2, 1 / 2, 1 / 2, 1 / 2])
+    # F (= global) : à risque 7, 7, 5, 3, 2, 1 ; paiements 0, 1, 2, 0, 0, 1
+    attendu = [1, 6 / 7, 6 / 7 * 3 / 5, 18 / 35, 18 / 35, 0]
+    np.testing.assert_allclose(courbe(modele, "fournisseurs", fournisseur="F"), attendu)
+    np.testing.assert_allclose(courbe(modele, "global"), attendu)
+
+
+def test_courbe_encaissements_cas_connu(app):
+    modele = app["survie_paiements"](petit_historique(), AJD)
+    f_att = pd.DataFrame({"assureur": ["A", "B", "C", "A"], "fournisseur": ["F", "F", "F", "F"],
+                          "montant": [100.0, 50.0, 10.0, 1000.0], "delai_actuel": [3, 4, 1, 10]})
+    # (A, F) à 3 jours : S(3) = 1/2, payée d'ici 2 jours (S(5) = 0).
+    # (B, F) à 4 jours : S reste à 1/2, jamais payée dans l'horizon.
+    # Assureur C inconnu : courbe du fournisseur, 1 − (18/35)/(6/7) = 0,4 dès le lendemain.
+    # Plus âgée que tout l'historique (S = 0 à tous les niveaux) : aucune estimation.
+    np.testing.assert_allclose(app["courbe_encaissements"](f_att, modele, 3), [0, 4, 104, 104])
+    montants, probas = app["probas_encaissement"](f_att, modele, [0, 1, 2, 3])
+    np.testing.assert_allclose(probas, [[0, 0, 1, 1], [0, 0, 0, 0], [0, 0.4, 0.4, 0.4], [0, 0, 0, 0]])
+
+
+def test_simulation_centree_sur_la_courbe_attendue(app):
+    df = factures(2000)
+    modele, f_att = app["survie_paiements"](df, AJD), en_attente(df)
+    jours = [7, 14, 30, 60]
+    cumuls = app["simuler_encaissements"](f_att, modele, jours)
+    assert cumuls.shape == (app["NB_SCENARIOS"], len(jours))
+
+    montants, probas = app["probas_encaissement"](f_att, modele, jours)
+    esperance = app["courbe_encaissements"](f_att, modele, max(jours))[jours]
+    np.testing.assert_allclose(montants @ probas, esperance)
+    np.testing.assert_allclose(cumuls.mean(axis=0), esperance, rtol=0.01)
+
+    p10, p50, p90 = np.percentile(cumuls, [10, 50, 90], axis=0)
+    assert (p10 <= p50).all() and (p50 <= p90).all() and (p10 < p90).all()
+    assert (np.diff(cumuls, axis=1) >= 0).all()
+    assert (cumuls[:, -1] <= montants.sum()).all()
+
+
+def test_simulation_sans_modele_ni_facture(app):
+    df = factures(200)
+    f_att = en_attente(df)
+    assert not app["simuler_encaissements"](f_att, None, [7, 30]).any()
+    modele = app["survie_paiements"](df, AJD)
+    assert app["simuler_encaissements"](f_att.iloc[:0], modele, [7, 30], nb_scenarios=50).shape == (50, 2)
@@ -0,0 +1,204 @@
+"""Flux patients et séries des factures : les étapes réécrites (épisodes, nouveaux, index de recrutement,
+calendrier des jours ouvrés, cohortes, tranches de période, délais mensuels) contre la version d'origine."""
+import ast
+import os
+import subprocess
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import APP, charger_source
+
+# Commit d'origine de app.py : get_full_analysis y est une fonction imbriquée dans la page Pilotage
+REFERENCE = "c2e23a7"
+# Colonnes d'un onglet Prestation brut tel que le lisait la version d'origine (code en 2, patient en 8, chiffre en 11)
+ENTETES_BRUTS = ["N° de facture", "Date", "Code tarifaire", "Description", "Quantité", "Points", "Valeur point",
+                 "Thérapeute", "#Patient", "Patient", "Facturation", "Chiffre CHF"]
+
+
+@pytest.fixture(scope="module")
+def reference():
+    """Fonctions de la version d'origine, get_full_analysis comprise (sortie de sa page, sans cache)."""
+    try:
+        source = subprocess.run(["git", "show", f"{REFERENCE}:app.py"], cwd=os.path.dirname(APP),
+                                capture_output=True, check=True).stdout.decode("utf-8")
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip(f"version d'origine {REFERENCE} absente de l'historique git")
+    ns = charger_source(source, f"app.py@{REFERENCE}")
+    imbriquee = next(n for n in ast.walk(ast.parse(source))
+                     if isinstance(n, ast.FunctionDef) and n.name == "get_full_analysis")
+    imbriquee.decorator_list = []
+    exec(compile(ast.Module(body=[imbriquee], type_ignores=[]), f"app.py@{REFERENCE}", "exec"), ns)
+    # L'onglet « lu » est directement le tableau brut passé en guise de fichier
+    ns["lire_prestations"] = lambda f: f.copy()
+    return ns
+
+
+def prestations(nb_patients=150, graine=0, debut="2024-01-01", nb_jours=600):
+    """Prestations de nb_jours jours au schéma de l'ingestion : traitements 7301/7311 précédés ou non d'un
+    bilan 7350, pauses plus ou moins longues que le délai de fin, patients à une seule séance, traitements
+    encore en cours à la fin (dont chroniques), 25.110, autres codes, lignes à montant nul et sans patient."""
+    rng = np.random.default_rng(graine)
+    origine = pd.Timestamp(debut)
+    lignes = []
+    for pat in range(1, nb_patients + 1):
+        jour = int(rng.integers(0, nb_jours - 50))
+        for _ in range(int(rng.integers(1, 4))):
+            if rng.random() < 0.15:
+                lignes.append((jour, "25.110", pat, 60.0))
+            else:
+                if rng.random() < 0.8:
+                    lignes.append((jour, "7350", pat, 48.0))
+                nb = 1 if rng.random() < 0.15 else int(rng.integers(2, 60))
+                for _ in range(nb):
+                    lignes.append((jour, str(rng.choice(["7301", "7311"])), pat, 48.0))
+                    jour += int(rng.integers(1, 9))
+            jour += int(rng.choice([10, 45, 90, 200]))
+    for _ in range(300):
+        lignes.append((int(rng.integers(0, nb_jours)), "7354", float(rng.integers(1, nb_patients)), 25.0))
+    lignes += [(10, "7301", np.nan, 48.0), (20, "7301", 3, 0.0), (30, "7350", 4, 0.0)]
+    df = pd.DataFrame(lignes, columns=["jour", "code_tarifaire", "num_patient", "chiffre"])
+    df = df[df["jour"] < nb_jours]
+    df["date_facture"] = origine + pd.to_timedelta(df.pop("jour"), "D")
+    df["num_patient"] = df["num_patient"].astype(float)
+    return df.sort_values("date_facture", kind="stable").reset_index(drop=True)
+
+
+def brut(df):
+    """Même contenu, en onglet brut de la version d'origine."""
+    out = pd.DataFrame({c: pd.Series(np.nan, index=df.index, dtype=object) for c in ENTETES_BRUTS})
+    out["N° de facture"] = np.arange(len(df))
+    out["Date"], out["Code tarifaire"] = df["date_facture"], df["code_tarifaire"]
+    out["#Patient"], out["Chiffre CHF"] = df["num_patient"], df["chiffre"]
+    return out
+
+
+def comparer(app, reference, df, nom, delai_fin=60, seuil_jour=100):
+    attendu = reference["get_full_analysis"](brut(df), None, delai_fin, seuil_jour)
+    # Les étapes sont en cache par clé d'historique : une clé par jeu de données
+    obtenu = app["get_full_analysis"](df, (f"{nom}-{delai_fin}-{seuil_jour}",), delai_fin, seuil_jour)
+    for cle, valeur in attendu.items():
+        assert obtenu[cle] == (valeur if isinstance(valeur, pd.Timestamp) else pytest.approx(valeur)), cle
+    return obtenu
+
+
+@pytest.mark.parametrize("delai_fin", [30, 60, 120])
+@pytest.mark.parametrize("seuil_jour", [0, 100, 300])
+def test_analyse_identique_a_l_origine(app, reference, delai_fin, seuil_jour):
+    comparer(app, reference, prestations(), "general", delai_fin, seuil_jour)
+
+
+def test_calendrier_vide(app, reference):
+    """Aucun jour n'atteint le seuil : une fenêtre compte un jour ouvré, comme à l'origine."""
+    data = comparer(app, reference, prestations(60, graine=1), "vide", seuil_jour=10**9)
+    assert data["recrutement"]["ouvert"].sum() == 0
+
+
+def test_fenetres_avant_l_origine_du_calendrier(app, reference):
+    """Historique court dont les premiers jours restent sous le seuil : les fenêtres de 120 et 365 jours
+    commencent avant le premier jour ouvré du calendrier."""
+    df = prestations(40, graine=2)
+    df = df[df["date_facture"] < df["date_facture"].min() + pd.Timedelta(days=150)]
+    df.loc[df["date_facture"] < df["date_facture"].min() + pd.Timedelta(days=40), "chiffre"] = 1.0
+    comparer(app, reference, df, "avant-origine", seuil_jour=50)
+
+
+def test_patient_a_une_seule_seance(app, reference):
+    df = pd.DataFrame({"date_facture": pd.to_datetime(["2025-03-03", "2025-03-03", "2025-03-10", "2025-05-20"]),
+                       "code_tarifaire": ["7350", "7301", "25.110", "7311"],
+                       "num_patient": [1.0, 1.0, 2.0, 3.0], "chiffre": [48.0, 48.0, 60.0, 48.0]})
+    data = comparer(app, reference, df, "seance-unique", seuil_jour=10)
+    assert data["rythme_reel"] == 1.1 and data["moy_seances"] == 1
+
+
+def test_bilan_a_la_limite_du_delai_de_fin(app, reference):
+    """Bilans 7350 exactement delai_fin jours, puis delai_fin + 1 jours, après la dernière séance du patient."""
+    dates = pd.to_datetime(["2025-01-06", "2025-02-03", "2025-04-04", "2025-02-03", "2025-04-05", "2025-04-20"])
+    df = pd.DataFrame({"date_facture": dates, "code_tarifaire": ["7354", "7301", "7350", "7311", "7350", "7301"],
+                       "num_patient": [9.0, 1.0, 1.0, 2.0, 2.0, 1.0], "chiffre": 48.0})
+    data = comparer(app, reference, df, "limite-delai", seuil_jour=10)
+    assert data["flux_365"][0] == 1
+
+
+def test_jours_ouvres_comme_l_ensemble_de_jours(app, reference):
+    """Calendrier à sommes cumulées contre le comptage d'origine sur un ensemble de dates, y compris
+    avant son premier jour, après son dernier, plages inversées et calendrier vide."""
+    rng = np.random.default_rng(3)
+    dates = pd.Series(pd.Timestamp("2025-01-06") + pd.to_timedelta(rng.integers(0, 200, 400), "D"))
+    montants = pd.Series(rng.uniform(0, 100, 400))
+    for seuil in (0, 150, 10**9):
+        calendrier = app["calendrier_ouverture"](dates, montants, seuil)
+        ca = montants.groupby(dates.dt.date).sum()
+        jours = set(ca.index[ca >= seuil])
+        for _ in range(200):
+            debut = pd.Timestamp("2024-11-01") + pd.Timedelta(days=int(rng.integers(0, 330)))
+            fin = debut + pd.Timedelta(days=int(rng.integers(-20, 250)))
+            assert app["jours_ouvres"](debut, fin, calendrier) == reference["jours_ouvres"](debut, fin, jours), (seuil, debut, fin)
+
+
+def test_cohortes_incrementales_identiques_au_calcul_complet(app):
+    """Ajout d'un export : les mois recalculés seuls donnent les mêmes matrices qu'un calcul complet."""
+    df = prestations(graine=4)
+    coupure = df["date_facture"].min() + pd.Timedelta(days=300)
+
+    def cohortes(d, nom, memo):
+        cles = (f"cohortes-{nom}",)
+        premiere, derniere = app["flux_bornes"](d, cles)
+        df_f = app["flux_evenements"](d, cles)
+        return app["cohortes_mensuelles"](app["flux_episodes"](d, cles, 60)["episodes"],
+                                          lambda: df_f[df_f["_type"] == "physio"], premiere, derniere, 60, memo)
+
+    memo = {}
+    cohortes(df[df["date_facture"] <= coupure], "partiel", memo)
+    incremental = cohortes(df, "complet", memo)
+    complet = cohortes(df, "complet", {})
+    for a, b in zip(incremental, complet):
+        pd.testing.assert_frame_equal(a, b) if isinstance(a, pd.DataFrame) else pd.testing.assert_series_equal(a, b)
+    assert not complet[0].empty
+
+
+def factures(graine=5):
+    """Factures triées par date de facturation sur dix mois ; aucune facture de mars 2025 n'est payée."""
+    rng = np.random.default_rng(graine)
+    n = 600
+    df = pd.DataFrame({"assureur": pd.Categorical(rng.choice(["A1", "A2"], n)),
+                       "date_facture": pd.Timestamp("2024-11-01") + pd.to_timedelta(rng.integers(0, 300, n), "D")})
+    df["date_paiement"] = df["date_facture"] + pd.to_timedelta(rng.integers(1, 60, n), "D")
+    df.loc[df["date_facture"].dt.to_period("M") == pd.Period("2025-03"), "date_paiement"] = pd.NaT
+    df = df.sort_values("date_facture", kind="stable").reset_index(drop=True)
+    df["delai"] = (df["date_paiement"] - df["date_facture"]).dt.days
+    return df
+
+
+@pytest.mark.parametrize("mois", [None, 1, 3, 6, 12, 24])
+def test_tranches_comme_le_filtre_d_origine(app, mois):
+    df = factures()
+    ajd = pd.Timestamp("2025-08-31")
+    donnees = {"ajd": ajd, "df": df, "payees": df[df["date_paiement"].notna()]}
+    tranche, payees = app["tranches_periode"](donnees, mois)
+    limite = ajd - pd.DateOffset(months=mois) if mois else df["date_facture"].min()
+    attendu = df[df["date_facture"] >= limite]
+    pd.testing.assert_frame_equal(tranche, attendu)
+    pd.testing.assert_frame_equal(payees, attendu[attendu["date_paiement"].notna()])
+
+
+def test_mois_sans_facture_payee_reste_un_trou(app):
+    df = factures()
+    payees = df[df["date_paiement"].notna()]
+    serie = app["delais_mensuels"](payees)
+    attendu = payees.groupby(["assureur", payees["date_facture"].dt.to_period("M")], observed=True)["delai"]
+    assert (serie["nb"].to_numpy() == attendu.size().to_numpy()).all()
+    np.testing.assert_allclose(serie["moyenne"], attendu.mean())
+    np.testing.assert_allclose(serie["p90"], attendu.quantile(0.9))
+    assert pd.Timestamp("2025-03-01") not in serie.index.get_level_values("mois")
+
+    for lissage in (1, 3):
+        courbes = app["courbes_delais"](serie, "moyenne", ["A1", "A2"], lissage)
+        assert list(courbes.columns) == ["A1", "A2"]
+        assert courbes.index.freqstr == "MS" and len(courbes) == 10
+        assert courbes.loc["2025-03-01"].isna().all()
+        # Avril lissé sur 3 mois : moyenne de février et avril seulement
+        if lissage == 3:
+            brut_a1 = serie.xs("A1", level="assureur")["moyenne"]
+            assert courbes.loc["2025-04-01", "A1"] == round((brut_a1["2025-02-01"] + brut_a1["2025-04-01"]) / 2, 2)
@@ -0,0 +1,74 @@
+"""Historique multi-exports : clés de lignes et fusion d'exports qui se chevauchent."""
+import numpy as np
+import pandas as pd
+
+
+def prestations(nb_factures=3000, graine=0):
+    """Lignes de prestation d'une année au schéma de l'ingestion ; _id identifie chaque ligne réelle.
+    Une facture compte 1 à 4 lignes, parfois deux fois le même code le même jour."""
+    rng = np.random.default_rng(graine)
+    nb_lignes = rng.integers(1, 5, nb_factures)
+    factures = np.repeat(np.arange(10_000, 10_000 + nb_factures), nb_lignes)
+    dates = np.repeat(pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 365, nb_factures), "D"), nb_lignes)
+    n = len(factures)
+    df = pd.DataFrame({"num_facture": factures.astype(str), "date_facture": dates,
+                       "code_tarifaire": rng.choice(["7301", "7311", "7350"], n),
+                       "therapeute": pd.Categorical(rng.choice(["T1", "T2", "T3"], n)),
+                       "num_patient": np.repeat(rng.integers(1, 400, nb_factures), nb_lignes).astype(float),
+                       "chiffre": rng.uniform(20, 120, n)})
+    df["_id"] = np.arange(n)
+    return df
+
+
+def coupe(df, debut, fin):
+    return df[(df["date_facture"] >= debut) & (df["date_facture"] <= fin)].reset_index(drop=True)
+
+
+def fusion(app, *exports):
+    hist = app["historique_vide"]()
+    for i, df in enumerate(exports):
+        app["ajouter_a_historique"](hist, f"export{i}", df)
+    return hist
+
+
+def test_deux_exports_chevauchants_donnent_l_union(app):
+    complet = prestations()
+    a = coupe(complet, "2025-01-01", "2025-09-30")
+    b = coupe(complet, "2025-07-01", "2025-12-31")
+    # Types lus différemment dans le second export : n° de facture entier, n° de patient texte
+    b["num_facture"] = b["num_facture"].astype(int)
+    b["num_patient"] = b["num_patient"].astype(int).astype(str)
+    b["therapeute"] = b["therapeute"].cat.add_categories("T4")
+    hist = fusion(app, a, b)
+
+    communs = set(a["_id"]) & set(b["_id"])
+    assert communs and hist["doublons"] == len(communs)
+    fusionne = hist["prestations"]
+    assert len(fusionne) == len(complet) == len(a) + len(b) - len(communs)
+    assert sorted(fusionne["_id"]) == list(complet["_id"])
+    assert len(hist["cles_lignes"]) == len(complet)
+    assert isinstance(fusionne["therapeute"].dtype, pd.CategoricalDtype)
+
+    # Un export déjà fusionné (même contenu, autre fichier) n'ajoute rien
+    app["ajouter_a_historique"](hist, "copie", b)
+    assert len(hist["prestations"]) == len(complet) and hist["doublons"] == len(communs) + len(b)
+
+
+def test_numero_de_facture_reutilise_pour_un_autre_patient(app):
+    a = prestations(200)
+    b = a.copy()
+    b["num_patient"] += 1000
+    b["_id"] += len(a)
+    hist = fusion(app, a, b)
+    assert hist["doublons"] == 0 and len(hist["prestations"]) == 2 * len(a)
+
+
+def test_cles_lignes_stables_et_uniques(app):
+    complet = prestations(500)
+    cles = app["cles_lignes"](complet)
+    assert len(set(cles.tolist())) == len(complet)
+    # Même ligne, même clé, quel que soit le découpage de l'export ou le type lu pour les numéros
+    partie = coupe(complet, "2025-06-01", "2025-12-31")
+    partie["num_facture"] = partie["num_facture"].astype(float)
+    attendu = pd.Series(cles, index=complet["_id"])[partie["_id"]].to_numpy()
+    np.testing.assert_array_equal(app["cles_lignes"](partie), attendu)